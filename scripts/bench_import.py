@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Measure how long it takes to start spider_board, using "python -X importtime"
+for a per-module breakdown and timing a few runs of "spider_board -h".
+
+Use "--max-ms" to make the script fail when startup regresses past a budget.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module):
+    """
+    Run "python -X importtime" on a module and return a list of
+    (cumulative_us, self_us, module_name) tuples.
+    """
+    proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+            cwd=project_dir, stderr=subprocess.PIPE, universal_newlines=True)
+
+    if proc.returncode != 0:
+        raise RuntimeError('Importing {} failed:\n{}'.format(module,
+                                                             proc.stderr))
+
+    times = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times.append((int(cumulative_us), int(self_us), name.rstrip()))
+
+    return times
+
+
+def startup_time(runs):
+    """
+    The best wall time (in seconds) of several "spider_board -h" runs.
+    """
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'spider_board', '-h'],
+                cwd=project_dir, stdout=subprocess.DEVNULL, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('-m', '--module', default='spider_board.__main__',
+            help='The module to import (default: spider_board.__main__)')
+    parser.add_argument('-n', '--top', type=int, default=15,
+            help='How many of the slowest imports to show (default: 15)')
+    parser.add_argument('-r', '--runs', type=int, default=5,
+            help='Number of "spider_board -h" runs to time (default: 5)')
+    parser.add_argument('--max-ms', type=float,
+            help='Exit with an error if "spider_board -h" takes longer')
+    args = parser.parse_args()
+
+    times = import_times(args.module)
+    total = max(cumulative for cumulative, _, _ in times)
+
+    print('Importing {} took {:.1f} ms ({} modules)'.format(
+        args.module, total/1000, len(times)))
+    print()
+    print('{:>10} {:>10}  {}'.format('cumul [ms]', 'self [ms]', 'module'))
+    for cumulative, self_us, name in sorted(times, reverse=True)[:args.top]:
+        print('{:>10.1f} {:>10.1f}  {}'.format(cumulative/1000, self_us/1000,
+                                               name))
+
+    heavy = [name.strip() for _, _, name in times
+             if name.strip() in ('requests', 'bs4', 'tkinter',
+                                 'concurrent.futures')]
+    if heavy:
+        print()
+        print('Warning: eagerly imported {}'.format(', '.join(heavy)))
+
+    best = startup_time(args.runs)
+    print()
+    print('"spider_board -h" took {:.1f} ms (best of {})'.format(
+        best*1000, args.runs))
+
+    if args.max_ms is not None and best*1000 > args.max_ms:
+        print('Startup is over budget ({:.1f} ms > {:.1f} ms)'.format(
+            best*1000, args.max_ms))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
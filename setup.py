@@ -10,6 +10,9 @@ setup(name='spider_board',
           'requests',
           'bs4',
       ],
+      extras_require={
+          's3': ['boto3'],
+      },
       entry_points={
           'console_scripts': [
               'spider_board = spider_board.__main__:main',
@@ -1,2 +1,27 @@
-from .client import Browser
-from .gui import Gui
+import importlib
+
+# The heavy modules (requests, bs4, tkinter...) are only imported when one of
+# these names is first looked up, so "spider_board -h" stays fast.
+_lazy_attributes = {
+    'Browser': 'spider_board.client',
+    'Gui': 'spider_board.gui',
+    'BatchRunner': 'spider_board.batch',
+}
+
+__all__ = list(_lazy_attributes)
+
+
+def __getattr__(name):
+    try:
+        module_name = _lazy_attributes[name]
+    except KeyError:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(
+            __name__, name))
+
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -1,31 +1,72 @@
 import argparse
+import logging
 import os
 import sys
-import spider_board
 
 
 def main(argv=None):
     parser = argparse.ArgumentParser(description='Download all your units '
     'from blackboard')
-    parser.add_argument('username', help='Your username')
-    parser.add_argument('password', help='Your password')
+    parser.add_argument('username', nargs='?', help='Your username')
+    parser.add_argument('password', nargs='?', help='Your password')
+    parser.add_argument('-b', '--batch', dest='batch', metavar='FILE',
+            help='Crawl every account in FILE ("username password" per line)')
+    parser.add_argument('-p', '--parallel-accounts', dest='parallel_accounts',
+            type=int, default=4,
+            help='Number of accounts to crawl at once in batch mode '
+            '(default: 4)')
     parser.add_argument('-s', '--sequential', dest='sequential', 
             action='store_true', help='Run sequentially (off by default)')
     parser.add_argument('-t', '--threads', dest='threads', type=int, default=20,
             help='Number of threads to use (default: 20)')
     parser.add_argument('-d', '--destination', dest='destination',
-            help='Where to output the downloaded files')
+            help='Where to output the downloaded files. This can be a '
+            'directory, an archive (.zip, .tar, .tar.gz, .tar.bz2, .tar.xz) '
+            'or an S3 url (s3://bucket/prefix)')
+    parser.add_argument('--s3-endpoint', dest='s3_endpoint', metavar='URL',
+            help='Use a different S3 compatible server (e.g. a local MinIO)')
     parser.add_argument('-m', '--max-size', dest='max_size', type=int,
             help='The maximum download size in megabytes (default: 10MB)')
     parser.add_argument('-f', '--force', dest='force', action='store_true',
             help='Overwrite files if they already exist (default: False)')
+    parser.add_argument('--persist', dest='persist', action='store_true',
+            help='Keep the work queues on disk so an interrupted run can be '
+            'resumed later')
+    parser.add_argument('--resume', dest='resume', action='store_true',
+            help='Continue an interrupted run from where it stopped '
+            '(implies --persist)')
+    parser.add_argument('--retry-failed', dest='retry_failed',
+            action='store_true',
+            help='Only retry the items which failed in a previous run')
+    parser.add_argument('--retry-failed-file', dest='retry_failed_file',
+            metavar='FILE',
+            help='The dead letter file to retry (implies --retry-failed, '
+            'default: the spider_board_failed.jsonl file in the destination)')
+    parser.add_argument('--profile', dest='profile', action='store_true',
+            help='Profile the run (see --profile-mode)')
+    parser.add_argument('--profile-mode', dest='profile_mode',
+            choices=['sample', 'cprofile'],
+            help='How to profile (implies --profile): "sample" samples every '
+            'thread\'s stack (saved as spider_board.folded for flamegraphs), '
+            '"cprofile" uses cProfile (main thread only, saved as '
+            'spider_board.prof). Default: sample')
     parser.add_argument('-v', '--verbose', dest='verbose', action='store_true',
             help='Enable verbose output')
 
     args = parser.parse_args(argv or sys.argv[1:])
 
-    username = args.username
-    password = args.password
+    if not args.batch and not (args.username and args.password):
+        parser.error('a username and password are required unless using '
+                     '--batch')
+
+    if args.retry_failed_file:
+        args.retry_failed = True
+
+    if args.profile_mode:
+        args.profile = True
+
+    if args.batch and args.retry_failed:
+        parser.error('--retry-failed can only be used with a single account')
 
     if args.sequential:
         run_sequentially = True
@@ -38,18 +79,85 @@ def main(argv=None):
         download_dir = os.path.expanduser('~/Downloads/Blackboard/')
 
     if args.verbose:
-        import logging
-        spider_board.logger.setLevel(logging.DEBUG)
+        logging.getLogger('spider_board').setLevel(logging.DEBUG)
+
+    if download_dir.startswith('s3://'):
+        print('Downloading files to {}'.format(download_dir))
+    else:
+        print('Downloading files to {}'.format(os.path.abspath(download_dir)))
+
+    from spider_board.storage import open_storage
+
+    # When resuming, files saved by the last run must be kept
+    storage = open_storage(download_dir, s3_endpoint=args.s3_endpoint,
+                           append=args.resume)
+
+    with storage:
+        # Keep any crawl state next to the files if they're saved locally
+        if storage.local_dir is not None:
+            download_dir = storage.local_dir
+        else:
+            download_dir = os.getcwd()
 
-    print('Downloading files to {}'.format(os.path.abspath(download_dir)))
+        if args.profile:
+            from spider_board.profiling import PROFILERS
 
-    bob = spider_board.Browser(
-            username, 
-            password, 
+            profiler = PROFILERS[args.profile_mode or 'sample']()
+            profiler.start()
+            try:
+                run(args, download_dir, storage, run_sequentially)
+            finally:
+                profiler.stop()
+                profiler.save()
+        else:
+            run(args, download_dir, storage, run_sequentially)
+
+
+def run(args, download_dir, storage, run_sequentially):
+    # Only pull in the networking libraries once we know they're needed
+    if args.batch:
+        from spider_board.batch import BatchRunner, read_accounts
+
+        runner = BatchRunner(
+                read_accounts(args.batch),
+                download_dir,
+                storage=storage,
+                threads=args.threads,
+                parallel_accounts=args.parallel_accounts,
+                seq=run_sequentially,
+                max_size=args.max_size or 10,
+                force=args.force,
+                persist=args.persist,
+                resume=args.resume)
+        runner.run()
+        return
+
+    from spider_board.client import Browser
+
+    bob = Browser(
+            args.username, 
+            args.password, 
             download_dir,
+            storage=storage,
             seq=run_sequentially,
             max_size=args.max_size or 10,
-            force=args.force)
+            force=args.force,
+            persist=args.persist,
+            resume=args.resume)
+
+    if args.retry_failed:
+        if args.retry_failed_file:
+            dead_letter_file = os.path.expanduser(args.retry_failed_file)
+        else:
+            dead_letter_file = bob.dead_letters.filename
+
+        # The file is removed when a run has no failures
+        if not os.path.exists(dead_letter_file):
+            print('Nothing to retry, {} does not exist'.format(
+                dead_letter_file))
+            return
+
+        bob.load_dead_letters(dead_letter_file)
 
     bob.start_scraping()
 
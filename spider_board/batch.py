@@ -0,0 +1,270 @@
+import logging
+import os
+import sys
+import time
+from threading import Event, Lock
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from .client import Browser
+from .profiling import SpanTimer
+from .storage import LocalStorage
+from .utils import LOG_FILE, get_logger, humansize
+
+
+# Create the logging handlers and attach them
+logger = get_logger(__name__, LOG_FILE)
+
+stream_handler = logging.StreamHandler()
+stream_handler.setLevel(logging.INFO)
+logger.addHandler(stream_handler)
+
+
+class SharedDownload:
+    """
+    An attachment one account is downloading on behalf of the whole batch.
+    Once finished is set, location is the (storage, path) it was saved to, or
+    None if the download failed.
+    """
+    def __init__(self):
+        self.finished = Event()
+        self.location = None
+
+
+class UrlRegistry:
+    """
+    A thread-safe record of every attachment url that has been claimed for
+    downloading, shared between all the Browsers in a batch.
+    """
+    def __init__(self):
+        self._downloads = {}
+        self._lock = Lock()
+
+    def claim(self, url):
+        """
+        Returns None if nobody has claimed this url yet (and claims it),
+        otherwise the SharedDownload of whoever did.
+        """
+        with self._lock:
+            if url in self._downloads:
+                return self._downloads[url]
+            self._downloads[url] = SharedDownload()
+            return None
+
+    def finish(self, url, storage, path):
+        """
+        Let everyone waiting on a url know where it was saved.
+        """
+        with self._lock:
+            shared = self._downloads[url]
+        shared.location = (storage, path)
+        shared.finished.set()
+
+    def release(self, url):
+        """
+        Give up on a url, so the next account to claim it can have a go.
+        """
+        with self._lock:
+            shared = self._downloads.pop(url, None)
+        if shared is not None:
+            shared.finished.set()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._downloads)
+
+
+def read_accounts(filename):
+    """
+    Read a credentials file containing one "username password" pair per line.
+    Blank lines and lines starting with a "#" are ignored.
+    """
+    accounts = []
+
+    with open(filename) as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            try:
+                username, password = line.split(None, 1)
+            except ValueError:
+                raise ValueError('Line {} of {} should be "username password"'
+                                 .format(line_no, filename))
+
+            accounts.append((username, password))
+
+    return accounts
+
+
+class BatchRunner:
+    """
+    Crawl several accounts at once. Every account gets its own Browser (and
+    therefore its own session), but they all submit their work to the same
+    thread pool. An attachment shared by several accounts is only downloaded
+    once, then copied (or hard linked) into the other accounts' trees.
+
+    Each account's files are saved to "download_dir/username" (or the
+    "username" sub-directory of storage, if given). A combined progress line
+    is written every PROGRESS_INTERVAL seconds while the batch runs.
+    """
+    PROGRESS_INTERVAL = 10
+
+    def __init__(self, accounts, download_dir, threads=20, parallel_accounts=4,
+            storage=None, **browser_kwargs):
+        self.accounts = accounts
+        self.download_dir = os.path.abspath(download_dir)
+        # Every account saves into a sub-directory of the same storage so
+        # shared files can be copied between them
+        self.storage = storage or LocalStorage(self.download_dir)
+        self.threads = threads
+        self.parallel_accounts = parallel_accounts
+        self.browser_kwargs = browser_kwargs
+
+        self.seen_urls = UrlRegistry()
+        self.browsers = []
+        self.errors = {}
+        self.cancelled = set()
+        self.elapsed = 0
+
+        # Running totals built up from every browser's events
+        self.files_queued = 0
+        self.files_done = 0
+        self.bytes_received = 0
+        self._progress_lock = Lock()
+
+    def run(self, stream=sys.stdout):
+        logger.info('Starting batch of {} accounts'.format(len(self.accounts)))
+        start = time.time()
+
+        # The worker pool is shared by every Browser. Each account's crawl is
+        # driven from its own (separate) pool so a driver waiting on its
+        # futures never ties up a worker thread.
+        thread_pool = ThreadPoolExecutor(max_workers=self.threads)
+        drivers = ThreadPoolExecutor(max_workers=self.parallel_accounts)
+
+        jobs = {}
+        try:
+            for username, password in self.accounts:
+                browser = Browser(
+                        username,
+                        password,
+                        os.path.join(self.download_dir, username),
+                        thread_pool=thread_pool,
+                        seen_urls=self.seen_urls,
+                        storage=self._storage_for(username),
+                        quiet=True,
+                        **self.browser_kwargs)
+                browser.add_listener(self._on_event)
+                self.browsers.append(browser)
+
+                fut = drivers.submit(browser.start_scraping)
+                jobs[fut] = browser
+
+            self._wait_for(jobs, stream)
+        except KeyboardInterrupt:
+            logger.info('Batch halted by user, stopping every account')
+            for fut in jobs:
+                fut.cancel()
+            for browser in self.browsers:
+                browser.stop()
+            wait(jobs)
+        finally:
+            drivers.shutdown(cancel_futures=True)
+            thread_pool.shutdown(cancel_futures=True)
+
+        for fut, browser in jobs.items():
+            if fut.cancelled():
+                self.cancelled.add(browser.username)
+                if browser.state is not None:
+                    browser.state.close()
+            elif fut.exception() is not None:
+                logger.error('Crawl failed for {}: {!r}'.format(
+                    browser.username, fut.exception()))
+                self.errors[browser.username] = fut.exception()
+
+        self.elapsed = time.time() - start
+        self.report(stream)
+
+    def _wait_for(self, jobs, stream):
+        """
+        Wait for every account to finish, writing a progress line every so
+        often.
+        """
+        while True:
+            done, not_done = wait(jobs, timeout=self.PROGRESS_INTERVAL)
+            if not not_done:
+                break
+            self.write_progress(stream, len(done))
+
+    def _on_event(self, event):
+        with self._progress_lock:
+            if event.name == 'file_queued':
+                self.files_queued += 1
+            elif event.name == 'file_done':
+                self.files_done += 1
+            elif event.name == 'bytes_received':
+                self.bytes_received += event.data['nbytes']
+
+    def write_progress(self, stream, accounts_done):
+        with self._progress_lock:
+            stream.write('{}/{} accounts finished, {}/{} files, {}\n'.format(
+                accounts_done, len(self.accounts), self.files_done,
+                self.files_queued, humansize(self.bytes_received)))
+        stream.flush()
+
+    def _storage_for(self, username):
+        return self.storage.subdir(username)
+
+    def report(self, stream=sys.stdout):
+        """
+        Write a combined summary of what every account downloaded.
+        """
+        header = '{:<20} {:>6} {:>8} {:>12} {:>10} {:>8}'.format(
+                'Account', 'Units', 'Files', 'Size', 'Shared', 'Failed')
+        stream.write(header + '\n')
+        stream.write('-'*len(header) + '\n')
+
+        total_files = total_bytes = total_shared = total_failed = 0
+
+        for browser in self.browsers:
+            files = len(browser.download_sizes)
+            size = sum(browser.download_sizes)
+            shared = len(browser.skipped_duplicates)
+            failed = browser.dead_letters.count
+
+            total_files += files
+            total_bytes += size
+            total_shared += shared
+            total_failed += failed
+
+            if browser.username in self.errors:
+                status = ' (failed)'
+            elif browser.username in self.cancelled:
+                status = ' (not started)'
+            elif browser.interrupted:
+                status = ' (interrupted)'
+            else:
+                status = ''
+
+            stream.write('{:<20} {:>6} {:>8} {:>12} {:>10} {:>8}{}\n'.format(
+                browser.username, len(browser.units), files,
+                humansize(size), shared, failed, status))
+
+        stream.write('-'*len(header) + '\n')
+        stream.write('{:<20} {:>6} {:>8} {:>12} {:>10} {:>8}\n'.format(
+            'Total', '', total_files, humansize(total_bytes), total_shared,
+            total_failed))
+
+        if self.elapsed:
+            stream.write('Batch finished in {:.2f} seconds ({}/s)\n'.format(
+                self.elapsed, humansize(total_bytes / self.elapsed)))
+
+        # Every account's phase timings, as one table
+        spans = SpanTimer()
+        for browser in self.browsers:
+            spans.merge(browser.spans)
+
+        if spans.phases:
+            stream.write('\n')
+            spans.report(stream)
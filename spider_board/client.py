@@ -2,6 +2,7 @@ import mimetypes
 import string
 from urllib.parse import urljoin
 import sys
+import time
 import base64
 import re
 import requests
@@ -9,9 +10,17 @@ from bs4 import BeautifulSoup
 import logging
 import os
 from collections import namedtuple
-from queue import Queue, Empty
-from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
-
+from contextlib import contextmanager
+from queue import Empty
+from threading import BoundedSemaphore, Lock, local
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from .profiling import SpanTimer
+from .queues import CrawlState, WorkQueue
+from .retry import (Retrier, DeadLetters, ScrapeError, PermanentError,
+                    ServerError, SessionExpired, check_response,
+                    read_dead_letters)
+from .storage import LocalStorage
 from .utils import time_job, LOG_FILE, get_logger, humansize
 
 
@@ -24,6 +33,11 @@ stream_handler.setLevel(logging.INFO)
 logger.addHandler(stream_handler)
 
 
+# Something that happened during a crawl, handed to every listener registered
+# with Browser.add_listener()
+Event = namedtuple('Event', ['name', 'timestamp', 'data'])
+
+
 class Attachment:
     ALLOWED_CHARS = string.ascii_letters + string.digits + '[]()_-.#$%&*+~;:='
 
@@ -32,6 +46,8 @@ class Attachment:
         self.url = url
         self.data = None
         self.section = section
+        # Where (relative to the storage) it ended up, once it's saved
+        self.save_location = None
 
     def sanitise(self, name):
         temp = []
@@ -88,7 +104,51 @@ class Unit:
 
     def __repr__(self):
         return '<Unit: name="{}">'.format(self.name)
-        
+
+
+def item_record(kind, item):
+    """
+    Describe a unit, section or document (kind is "unit", "section" or 
+    "document") as a plain dict which can be saved as JSON and turned back
+    into the same item with item_from_record().
+    """
+    if kind == 'unit':
+        unit, parent = item, None
+    elif kind == 'section':
+        unit, parent = item.unit, item.parent_section
+    else:
+        unit, parent = item.section.unit, item.section
+
+    sections = []
+    while parent is not None:
+        sections.append([parent.title, parent.url])
+        parent = parent.parent_section
+    sections.reverse()
+
+    return {
+            'kind': kind,
+            'title': getattr(item, 'title', unit.name),
+            'url': item.url,
+            'unit': {'name': unit.name, 'url': unit.url, 'code': unit.code},
+            'sections': sections,
+            }
+
+
+def item_from_record(record):
+    unit = Unit(**record['unit'])
+    if record['kind'] == 'unit':
+        return unit
+
+    parent = None
+    for title, url in record['sections']:
+        parent = Section(unit, title, url, parent_section=parent)
+
+    if record['kind'] == 'section':
+        return Section(unit, record['title'], record['url'], 
+                       parent_section=parent)
+    else:
+        return Attachment(record['title'], record['url'], parent)
+
 
 class Browser:
     SKIP_FOLDERS = [
@@ -103,8 +163,30 @@ class Browser:
             'Help for Students',
             ]
 
+    # Emit a "bytes_received" event after roughly this many bytes
+    PROGRESS_STEP = 64*1024
+
+    # Where the work queues are saved (inside the storage's local directory,
+    # or download_dir if it doesn't have one) when persisting
+    STATE_FILE = '.spider_board_state.db'
+    # Everything which failed for good gets written here (in the same place)
+    DEAD_LETTER_FILE = 'spider_board_failed.jsonl'
+
+    # How long (in seconds) to wait for new sections before checking whether
+    # the crawl has finished
+    POLL_INTERVAL = 0.1
+
+    # Don't log in again if someone else did it less than this many seconds ago
+    RELOGIN_INTERVAL = 5
+
+    # (connect, read) timeouts in seconds for every request, so a stalled
+    # connection turns into a retryable RequestTimeout instead of a hang
+    REQUEST_TIMEOUT = (10, 60)
+
     def __init__(self, username, password, download_dir, blackboard_url=None, 
-            threads=8, seq=False, max_size=10, force=False):
+            threads=8, seq=False, max_size=10, force=False, thread_pool=None,
+            seen_urls=None, persist=False, resume=False, storage=None,
+            quiet=False):
         message = '  Initiating Browser   '
         logger.info('='*len(message))
         logger.info(message)
@@ -116,8 +198,11 @@ class Browser:
         self.username = username
         self.password = base64.b64encode(password.encode('utf-8')) 
         self.download_dir = os.path.abspath(download_dir)
+        self.storage = storage or LocalStorage(self.download_dir)
         self.force = force
         self.is_logged_in = False
+        self._login_lock = Lock()
+        self._last_login = 0
 
         if max_size > 0:
             self.max_size = max_size*1024*1024 # Maximum download size in bytes
@@ -127,17 +212,66 @@ class Browser:
         self.session = self.b = requests.session() 
         self.units = []
 
-        # The two "task" queues
-        self.sections = Queue()
-        self.documents = Queue()
+        # The two "task" queues, optionally backed by a database on disk so a
+        # crawl can be resumed after being killed
+        state_dir = self.storage.local_dir or self.download_dir
+
+        if persist or resume:
+            os.makedirs(state_dir, exist_ok=True)
+            state_file = os.path.join(state_dir, Browser.STATE_FILE)
+            logger.info('Saving crawl state to {}'.format(state_file))
+
+            self.state = CrawlState(state_file, resume=resume)
+            self.sections = self.state.queue('sections')
+            self.documents = self.state.queue('documents')
+        else:
+            self.state = None
+            self.sections = WorkQueue()
+            self.documents = WorkQueue()
 
         self.sequential = seq
         self.threads = threads
 
+        # Batch runs hand every Browser the same thread pool and url registry
+        # so work and duplicate attachments are shared between accounts
+        self.shared_thread_pool = thread_pool
+        self.seen_urls = seen_urls
+        self.thread_pool = None
+
+        # Jobs this browser has handed to the thread pool which haven't
+        # finished yet
+        self.futures = set()
+        self._futures_lock = Lock()
+
         self.download_sizes = []
+        self.skipped_duplicates = []
+
+        self.listeners = []
+        self.spans = SpanTimer()
+        # How deeply phases are nested on each thread
+        self._phase_depth = local()
+
+        # Batch runs print one combined report instead of one per account
+        self.quiet = quiet
+
+        self.dead_letters = DeadLetters(
+                os.path.join(state_dir, Browser.DEAD_LETTER_FILE),
+                keep_existing=resume)
+        self.retrier = Retrier(relogin=self.relogin, 
+                               dead_letters=self.dead_letters)
+
+        # Set when only retrying what's in a dead letter file
+        self.only_retry = False
+        self.interrupted = False
+        # Set by stop() to make the crawl wind down early
+        self._stop_requested = False
 
     def login(self):
+        """
+        Log in to Blackboard, raising a ScrapeError if it didn't work.
+        """
         logger.info('Logging in')
+        self._last_login = time.time()
         payload = {
                 'login': 'Login',
                 'action': 'login',
@@ -146,23 +280,86 @@ class Browser:
                 }
 
         # Do the login
-        r = self.b.post(self.login_url, data=payload)
+        r = self.b.post(self.login_url, data=payload,
+                        timeout=Browser.REQUEST_TIMEOUT)
 
         if 'You are being redirected to another page' in r.text:
             logger.info('Login was successful')
             self.is_logged_in = True
             self.run_hook('on_login_successful')
+            return
+
+        logger.error('Login failed')
+        self.is_logged_in = False
+        self.run_hook('on_login_failed')
+
+        if r.status_code >= 500:
+            raise ServerError('{} from {}'.format(r.status_code, r.url),
+                              r.status_code)
         else:
-            logger.error('Login failed')
-            self.run_hook('on_login_failed')
+            raise PermanentError('Unable to log in as {}'.format(
+                self.username))
+
+    def relogin(self):
+        """
+        Log in again after the session has expired. Lots of workers will
+        probably notice at once, so only the first one actually logs in.
+        """
+        with self._login_lock:
+            if time.time() - self._last_login < Browser.RELOGIN_INTERVAL:
+                return
+
+            logger.info('Session expired')
+            try:
+                self.login()
+            except (ScrapeError, requests.RequestException) as e:
+                # Whatever needed the session will fail again and be retried
+                logger.error('Unable to log in again: {}'.format(e))
+
+    def _get(self, url, **kwargs):
+        """
+        Do a GET request, raising a ScrapeError if it didn't work.
+        """
+        kwargs.setdefault('timeout', Browser.REQUEST_TIMEOUT)
+
+        with self.phase('request', url):
+            r = self.b.get(url, **kwargs)
+
+        check_response(r, self.login_url)
+        return r
+
+    def _get_soup(self, url):
+        r = self._get(url)
+
+        with self.phase('parse', url):
+            soup = BeautifulSoup(r.text, 'html.parser')
+
+        # Sometimes Blackboard just shows the login form instead of redirecting
+        if soup.find('input', attrs={'name': 'user_id'}) is not None:
+            raise SessionExpired('Got the login form for {}'.format(url))
+
+        return soup
 
     def get_units(self):
         url = self.blackboard_url + 'webapps/portal/execute/tabs/tabAction?tab_tab_group_id=_3_1'
 
-        r = self.b.get(url)
-        soup = BeautifulSoup(r.text, 'html.parser')
+        with self.phase('get_units', url):
+            units = self.retrier.call(self._find_units, url)
+        if units is None:
+            # Without the units there is nothing to crawl, so don't pretend
+            # the run worked
+            raise ScrapeError('Unable to get the list of units from {}'.format(
+                url))
+
+        self.units = units
+
+        self.run_hook('on_get_units')
+        self.emit('units_found', units=list(self.units))
+
+    def _find_units(self, url):
+        soup = self._get_soup(url)
 
-        course_links = []
+        units = []
         for link in soup.find_all('a'):
             # Because Blackboard is shit, you need to do a hack in order to
             # find all unit names
@@ -179,20 +376,36 @@ class Browser:
                 new_unit = Unit(name=name, url=l, code=code)
                 logger.debug('Unit found: {}'.format(new_unit))
 
-                self.units.append(new_unit)
+                units.append(new_unit)
 
-        self.run_hook('on_get_units')
+        return units
 
     def _scrape_unit(self, unit):
         logger.info('Scraping all documents for unit: {}'.format(unit))
-        
-        r = self.b.get(unit.url)
-        soup = BeautifulSoup(r.text, 'html.parser')
+
+        with self.phase('scrape_unit', unit.url):
+            sections = self.retrier.call(self._sections_in_unit, unit,
+                                         item_record('unit', unit))
+        if sections is None:
+            return
+
+        for new_section in sections:
+            logger.debug('Adding section: {}'.format(new_section))
+            self.sections.put(new_section)
+            self.emit('section_found', section=new_section)
+
+        if self.state is not None:
+            self.state.set('unit:' + unit.code, 'scraped')
+
+    def _sections_in_unit(self, unit):
+        soup = self._get_soup(unit.url)
 
         sidebar = soup.find(id='courseMenuPalette_contents')
-        links = sidebar.find_all('a')
+        if sidebar is None:
+            raise PermanentError('No course menu found for {}'.format(unit))
 
-        for link in links:
+        sections = []
+        for link in sidebar.find_all('a'):
             title = link.span['title']
             
             if title in Browser.SKIP_FOLDERS:
@@ -203,33 +416,48 @@ class Browser:
                 continue
 
             link = urljoin(self.blackboard_url, link['href'])
-            new_section = Section(unit, title, link)
-            logger.debug('Adding section: {}'.format(new_section))
-            self.sections.put(new_section)
+            sections.append(Section(unit, title, link))
+
+        return sections
 
     def _scrape_section(self, section):
         logger.info('Scraping section: {}'.format(section))
 
-        r = self.b.get(section.url)
-        soup = BeautifulSoup(r.text, 'html.parser')
+        try:
+            with self.phase('scrape_section', section.url):
+                found = self.retrier.call(self._parse_section, section,
+                                          item_record('section', section))
+            folders, files = found or ([], [])
+
+            for folder in folders:
+                self.sections.put(folder)
+                self.emit('section_found', section=folder)
+
+            for f in files:
+                self.documents.put(f)
+                self.emit('file_queued', document=f)
+
+            self.sections.mark_done(section)
+        finally:
+            # Call task_done() to notify the queue that a section has finished
+            # Being scraped (even if it failed, otherwise the crawl never
+            # finishes)
+            self.sections.task_done()
+
+    def _parse_section(self, section):
+        """
+        Fetch a section's page and find the (folders, files) inside it.
+        """
+        soup = self._get_soup(section.url)
 
         folders = self._folders_in_section(soup, section)
         logger.debug('{} folders found for this section: {}'.format(len(folders),
                                                                   section))
-        for folder in folders:
-            self.sections.put(folder)
 
         files = self._files_in_section(soup, section)
         logger.debug('{} files found for this section: {}'.format(len(files), 
                                                                   section))
-        for f in files:
-            self.documents.put(f)
-            
-        # Call task_done() to notify the queue that a section has finished
-        # Being scraped
-        self.sections.task_done()
-
-        return folders
+        return folders, files
 
     def _folders_in_section(self, soup, section):
         """
@@ -241,9 +469,8 @@ class Browser:
         content = soup.find(id='content')
 
         if content is None:
-            print(section.url)
-            import pdb
-            pdb.set_trace()
+            raise PermanentError('No content found in {} ({})'.format(
+                section, section.url))
 
         found_sections = []
         for link in content.find_all('a'):
@@ -280,42 +507,128 @@ class Browser:
 
     def spider_sequential(self):
         self.login()
-        self.get_units()
+        if not self.only_retry:
+            self.get_units()
 
-        for unit in self.units:
-            if '[' not in unit.name:
-                self._scrape_unit(unit)
+        for unit in self._units_to_scrape():
+            if self._stop_requested:
+                return
+            self._scrape_unit(unit)
 
-        while not self.sections.empty():
+        while not self.sections.empty() and not self._stop_requested:
             next_section = self.sections.get()
             self._scrape_section(next_section)
 
         logger.info('{} files found'.format(self.documents.qsize()))
 
+    def _units_to_scrape(self):
+        """
+        Skip units with a "[" in their name and, when resuming, any units
+        whose sections have already been saved to the crawl state.
+        """
+        units = []
+        for unit in self.units:
+            if '[' in unit.name:
+                continue
+
+            if (self.state is not None and
+                    self.state.get('unit:' + unit.code) == 'scraped'):
+                logger.debug('Already scraped unit: {}'.format(unit))
+                continue
+
+            units.append(unit)
+
+        return units
+
     def _download(self, document):
+        status = 'failed'
+        try:
+            while True:
+                shared = self._claim_url(document)
+
+                if shared is None:
+                    status = self._fetch(document)
+                    break
+
+                # Another account in the same batch is getting this one, so
+                # wait for it then copy their file
+                shared.finished.wait()
+                if shared.location is None:
+                    # They couldn't get it, try to claim it for ourselves
+                    continue
+
+                status = self._copy_shared(document, shared)
+                if status is None:
+                    status = self._fetch(document, claimed=False)
+                break
+
+            self.documents.mark_done(document)
+        finally:
+            self.emit('file_done', document=document, status=status)
+
+    def _fetch(self, document, claimed=True):
+        with self.phase('download', document.url):
+            status = self.retrier.call(self._save_document, document, 
+                    item_record('document', document)) or 'failed'
+
+        if claimed and self.seen_urls is not None:
+            if status in ('downloaded', 'skipped'):
+                storage, path = self.storage.resolve(document.save_location)
+                self.seen_urls.finish(document.url, storage, path)
+            else:
+                # Let another account have a go at it
+                self.seen_urls.release(document.url)
+
+        return status
+
+    def _copy_shared(self, document, shared):
+        """
+        Copy a file another account already downloaded into our own tree.
+        Returns None if that isn't possible (e.g. it's in a different
+        storage backend).
+        """
+        source_storage, source_path = shared.location
+
+        save_location = document.filename
+        if not os.path.splitext(save_location)[1]:
+            save_location += os.path.splitext(source_path)[1]
+
+        if self._already_downloaded(save_location):
+            logger.info('Skipping file: {}'.format(save_location))
+            return 'skipped'
+
+        storage, path = self.storage.resolve(save_location)
+        if storage is not source_storage:
+            return None
+
+        logger.info('Already downloaded by another account: {}'.format(
+            document.url))
+        storage.copy(source_path, path)
+
+        document.save_location = save_location
+        self.skipped_duplicates.append(document.url)
+        return 'duplicate'
+
+    def _save_document(self, document):
+        """
+        Download a single document, returning a short string saying what
+        happened to it ("downloaded", "skipped" or "too_big"). Raises a
+        ScrapeError if the download fails.
+        """
         logger.info('Downloading "{}"'.format(document.title))
 
-        save_location = os.path.join(self.download_dir, document.filename)
-        parent_dir = os.path.dirname(save_location)
+        # Relative to the storage backend
+        save_location = document.filename
 
         if self._already_downloaded(save_location):
             logger.info('Skipping file: {}'.format(save_location))
-            return
+            document.save_location = save_location
+            return 'skipped'
 
         content_headers = self.read_headers(document)
-        
-        # make the document's parent directories
-        os.makedirs(parent_dir, exist_ok=True)
 
-        # Start streaming the file and saving chunks to disk
-        r = self.b.get(document.url, stream=True)
-
-        if not r.ok:
-            logger.error('Request Failed!')
-            logger.error('URL: {}'.format(document.url))
-            logger.error('Status code: {}'.format(r.status_code))
-            logger.error(r.text)
-            return
+        # Start streaming the file and saving chunks to storage
+        r = self._get(document.url, stream=True)
 
         # Check if there is a file extension, if not infer from request
         # context
@@ -334,25 +647,54 @@ class Browser:
 
         if self._already_downloaded(save_location):
             logger.info('Skipping file: {}'.format(save_location))
-            return
+            document.save_location = save_location
+            return 'skipped'
 
         file_size = int(r.headers['content-length'])
         if file_size > self.max_size:
             logger.warn('File too big: {}'.format(document))
             logger.warn('Size: {}'.format(humansize(file_size)))
             logger.warn('Proposed save location: {}'.format(save_location))
-            return
+            return 'too_big'
 
-        with open(save_location, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=1024): 
-                if chunk: # filter out keep-alive new chunks
-                    f.write(chunk)
+        self.storage.save(save_location, self._iter_chunks(r, document))
+        document.save_location = save_location
 
         self.download_sizes.append(int(r.headers['content-length']))
+        return 'downloaded'
+
+    def _iter_chunks(self, response, document):
+        """
+        Yield the response body chunk by chunk, emitting "bytes_received"
+        events as we go.
+        """
+        received = 0
+        for chunk in response.iter_content(chunk_size=1024): 
+            if chunk: # filter out keep-alive new chunks
+                yield chunk
+                received += len(chunk)
+
+                if received >= self.PROGRESS_STEP:
+                    self.emit('bytes_received', document=document,
+                              nbytes=received)
+                    received = 0
+
+        if received:
+            self.emit('bytes_received', document=document, nbytes=received)
+
+    def _claim_url(self, document):
+        """
+        Check whether another account in the same batch is already getting
+        this one. Returns None if it's up to us, otherwise their 
+        SharedDownload.
+        """
+        if self.seen_urls is None:
+            return None
+        return self.seen_urls.claim(document.url)
 
     def _already_downloaded(self, save_location):
         # Check if the user wants to overwrite existing documents
-        if os.path.exists(save_location):
+        if self.storage.exists(save_location):
             if self.force:
                 return False
             else:
@@ -361,20 +703,23 @@ class Browser:
             return False
 
     def read_headers(self, document):
-        r = requests.head(document.url,
-                headers={'Accept-Encoding': 'identity'})
+        r = self.b.head(document.url,
+                headers={'Accept-Encoding': 'identity'},
+                timeout=Browser.REQUEST_TIMEOUT)
 
         return r.headers
 
     def download_files_sequential(self):
         logger.info('Now downloading files')
         
-        while not self.documents.empty():
+        while not self.documents.empty() and not self._stop_requested:
             try:
                 next_document = self.documents.get()
                 self._download(next_document)
             except KeyboardInterrupt:
                 logger.info('Execution halted by user')
+                self.interrupted = True
+                self.documents.checkpoint()
                 logger.info('Last file to be downloaded: {}'.format(next_document))
                 logger.info('Save location: {}'.format(next_document.filename))
                 break
@@ -383,112 +728,254 @@ class Browser:
 
     def spider_concurrent(self):
         self.login()
-        self.get_units()
+        if not self.only_retry:
+            self.get_units()
 
         # Do the initial scrapes for each unit
-        for unit in self.units:
-            if '[' not in unit.name:
-                fut = self.thread_pool.submit(self._scrape_unit, unit)
-                self.futures.append(fut)
-
-        # Wait so that we have some sections in the queue initially
-        wait(self.futures, return_when=FIRST_COMPLETED)
-
-        while not self.sections.empty():
-            section = self.sections.get()
-
-            # Tell the thread pool to scrape that section then add the
-            # Future to a list 
-            fut = self.thread_pool.submit(self._scrape_section, section)
-
-            callback = lambda future: self._requeue(self._scrape_section, future)
-            fut.add_done_callback(callback)
+        unit_futures = []
+        for unit in self._units_to_scrape():
+            fut = self.thread_pool.submit(self._scrape_unit, unit)
+            fut.add_done_callback(self._log_failure)
+            unit_futures.append(fut)
+
+        # Nested folders only ever reach the thread pool through the sections
+        # queue, so keep handing out sections until every unit has been
+        # scraped and every section put on the queue has been finished
+        while not self._stop_requested:
+            self._in_flight.acquire()
+            try:
+                section = self.sections.get(timeout=Browser.POLL_INTERVAL)
+            except Empty:
+                self._in_flight.release()
+                units_done = all(fut.done() for fut in unit_futures)
+                if units_done and self.sections.unfinished_tasks == 0:
+                    break
+                continue
 
-            self.futures.append(fut)
+            self._submit(self._scrape_section, section)
 
-        self.sections.join()
         logger.info('{} files found'.format(self.documents.qsize()))
 
     def download_concurrent(self):
         logger.info('Now downloading the files')
 
-        while not self.documents.empty():
-            new_document = self.documents.get()
-            fut = self.thread_pool.submit(self._download, new_document)
-
-            callback = lambda future: self._requeue(self._download, future)
-            fut.add_done_callback(callback)
+        while not self._stop_requested:
+            self._in_flight.acquire()
+            try:
+                new_document = self.documents.get_nowait()
+            except Empty:
+                self._in_flight.release()
+                break
 
-            self.futures.append(fut)
+            self._submit(self._download, new_document)
 
-    def _requeue(self, func, fut):
+    def _submit(self, func, item):
         """
-        This function will iterate over the future's return value, submitting
-        a new job to the thread pool with the value as it's only argument.
-        Then it attaches a callback so that once *that* job is done, it'll do
-        the same again until all the tasks are complete.
-        
-        In order to set it as a callback you need to do a small hack using 
-        lambda functions. Initial use when queueing the function you want to
-        be repeated::
-
-            fut = self.thread_pool.submit(function_to_call_again, section)
-
-            callback = lambda future: self._requeue(function_to_call_again, future)
-            fut.add_done_callback(callback)
-
-            self.futures.append(fut)
+        Hand an item to the thread pool. The caller must have acquired a slot
+        from self._in_flight, which is given back when the job finishes, so
+        only a few items are ever unpickled and waiting in the pool's queue.
+        """
+        with self._futures_lock:
+            if self._stop_requested:
+                # Left "taken" in the crawl state for --resume
+                self._in_flight.release()
+                return
+
+            fut = self.thread_pool.submit(func, item)
+            self.futures.add(fut)
+        fut.add_done_callback(self._job_done)
+
+    def _job_done(self, fut):
+        with self._futures_lock:
+            self.futures.discard(fut)
+        self._in_flight.release()
+        self._log_failure(fut)
+
+    def _pending_futures(self):
+        with self._futures_lock:
+            return list(self.futures)
+
+    def _log_failure(self, fut):
+        """
+        Make sure exceptions raised inside the thread pool don't go unnoticed.
         """
-        sections = fut.result()
+        if not fut.cancelled() and fut.exception() is not None:
+            logger.error('Job failed: {!r}'.format(fut.exception()))
 
-        if not sections:
-            return
+    def start_scraping(self):
+        if self.quiet:
+            self.crawl()
+        else:
+            time_job()(self.crawl)()
+
+    def crawl(self):
+        try:
+            self._run()
+        except KeyboardInterrupt:
+            self.interrupted = True
+            raise
+        finally:
+            if self._keep_old_dead_letters():
+                self.dead_letters.discard()
+            else:
+                self.dead_letters.commit()
 
-        for section in sections:
-            new_future = self.thread_pool.submit(func, section)
+            # Save whatever was discovered, even if we were interrupted
+            if self.state is not None:
+                self.state.close()
 
-            callback = lambda future: self._requeue(func, future)
-            new_future.add_done_callback(callback)
+        self.run_hook('on_finish_downloads')
+        self.emit('finished')
+        self._report()
 
-            self.futures.append(new_future)
+    def _keep_old_dead_letters(self):
+        """
+        A retry which was cut short still needs the old dead letters, and so
+        does a crawl which never got as far as finding any units (e.g. the
+        login failed or Blackboard was down). Otherwise they're replaced with
+        this run's.
+        """
+        if self.only_retry:
+            return self.interrupted
+        else:
+            return not self.units
 
-    @time_job()
-    def start_scraping(self):
+    def _run(self):
         if self.sequential:
             self.spider_sequential()
             self.download_files_sequential()
         else:
-            self.thread_pool = ThreadPoolExecutor(max_workers=self.threads)
-            self.futures = []
+            if self.shared_thread_pool is not None:
+                self.thread_pool = self.shared_thread_pool
+            else:
+                self.thread_pool = ThreadPoolExecutor(max_workers=self.threads)
+            self._in_flight = BoundedSemaphore(self.threads * 2)
 
             try:
                 self.spider_concurrent()
                 self.download_concurrent()
-                wait(self.futures)
+                wait(self._pending_futures())
             except KeyboardInterrupt:
                 logger.info('Execution halted by user')
-                self.thread_pool.shutdown()
+                self.interrupted = True
+                self._shutdown_thread_pool()
 
-        self.run_hook('on_finish_downloads')
+    def _report(self):
         bytes_downloaded = sum(self.download_sizes)
         logger.info('{} bytes downloaded'.format(humansize(bytes_downloaded)))
 
+        if not self.quiet:
+            self.spans.report()
+
+        if self.dead_letters.count:
+            logger.warning('{} items failed, see {} (use --retry-failed to '
+                           'try them again)'.format(self.dead_letters.count,
+                                                    self.dead_letters.filename))
+
+    def load_dead_letters(self, filename):
+        """
+        Instead of crawling everything, only retry the units, sections and
+        documents in a dead letter file from a previous run.
+        """
+        records = read_dead_letters(filename)
+        logger.info('Retrying {} failed items from {}'.format(len(records),
+                                                              filename))
+
+        # Whatever still fails replaces the old file once the run finishes
+        self.only_retry = True
+        self.dead_letters.discard()
+
+        for record in records:
+            item = item_from_record(record)
+
+            if record['kind'] == 'unit':
+                self.units.append(item)
+            elif record['kind'] == 'section':
+                self.sections.put(item)
+            else:
+                self.documents.put(item)
+
     def quit(self):
         # Run the "on_quit" function if it is defined
         self.run_hook('on_quit')
 
         logger.info('Shutting down thread pool and exiting...')
-        self.thread_pool.shutdown()
+        self._shutdown_thread_pool()
         sys.exit(1)
 
-    def run_hook(self, hook_name):
+    def stop(self):
+        """
+        Ask a running crawl to finish early (e.g. because the batch it's part
+        of was interrupted). Jobs which haven't started are cancelled, and
+        anything not done yet is left in the crawl state for --resume.
+        """
+        logger.info('Stopping the crawl for {}'.format(self.username))
+        self.interrupted = True
+
+        with self._futures_lock:
+            self._stop_requested = True
+
+        for fut in self._pending_futures():
+            fut.cancel()
+
+    def _shutdown_thread_pool(self):
+        # Anything which hasn't started yet is left "taken" in the crawl
+        # state, so --resume will do it again
+        for fut in self._pending_futures():
+            fut.cancel()
+
+        # A shared pool belongs to whoever created it, leave it running
+        if self.thread_pool is not None and self.shared_thread_pool is None:
+            self.thread_pool.shutdown(wait=True, cancel_futures=True)
+
+    def add_listener(self, listener):
+        """
+        Register a callable which will be given an Event every time something
+        interesting happens ("units_found", "section_found", "file_queued",
+        "bytes_received", "file_done" and "finished").
+
+        Listeners are called from whichever thread raised the event, so they
+        should be quick and thread-safe (e.g. Queue.put).
+        """
+        self.listeners.append(listener)
+
+    def emit(self, event_name, **data):
+        event = Event(event_name, time.time(), data)
+        for listener in self.listeners:
+            listener(event)
+
+    @contextmanager
+    def phase(self, name, label=None):
+        """
+        Time a phase of the crawl (wall and CPU time), running the
+        "before_<name>" and "after_<name>" hooks either side of it. The
+        "after" hook also gets the number of seconds the phase took.
+        """
+        self.run_hook('before_' + name, label)
+        depth = getattr(self._phase_depth, 'value', 0)
+        self._phase_depth.value = depth + 1
+        start, start_cpu = time.perf_counter(), time.thread_time()
+
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.thread_time() - start_cpu
+            self._phase_depth.value = depth
+
+            # Only the outermost phase goes in the slowest URLs, the ones
+            # inside it would just list the same URL again
+            self.spans.record(name, label if depth == 0 else None, wall, cpu)
+            self.run_hook('after_' + name, label, wall)
+
+    def run_hook(self, hook_name, *args):
         """
-        Run the function "self.hook_name()" if it exists.
+        Run the function "self.hook_name(*args)" if it exists.
         """
         hook = getattr(self, hook_name, None)
         if hook is not None:
             logger.info('Running hook {}.{}()'.format(self.__class__.__name__,
                                                       hook_name))
-            hook(self)
+            hook(self, *args)
 
 
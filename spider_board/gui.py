@@ -4,9 +4,13 @@ from tkinter.messagebox import showwarning, showerror, showinfo
 from tkinter import ttk
 import logging
 import sys
+import time
+from collections import OrderedDict
+from queue import Queue, Empty
 from threading import Thread
 
-from spider_board.client import Browser
+from spider_board.client import Browser, Event
+from spider_board.retry import ScrapeError
 from spider_board.utils import time_job, LOG_FILE, get_logger, humansize
 
 
@@ -18,12 +22,50 @@ stream_handler.setLevel(logging.DEBUG)
 logger.addHandler(stream_handler)
 
 
+class UnitProgress:
+    """
+    Running totals for a single unit, built up from the browser's events.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.queued = 0
+        self.done = 0
+        self.bytes_received = 0
+
+    def __str__(self):
+        return '{} - {}/{} files ({})'.format(self.name, self.done, 
+                self.queued, humansize(self.bytes_received))
+
+
 class Gui:
+    # How often (in milliseconds) to drain the event queue
+    POLL_INTERVAL = 200
+    # Maximum number of events to handle per poll so the UI stays responsive
+    MAX_EVENTS_PER_POLL = 500
+
     def __init__(self):
         logger.info('Instantiating GUI')
         self.root = tk.Tk()
         self.browser = None
+        self.credentials = None
+        self.downloading = False
+
+        # Events from the browser's worker threads are pushed onto this queue
+        # and only ever consumed on the Tk main thread
+        self.events = Queue()
+        self.reset_progress()
+
         self.make_gui()
+        self.root.after(self.POLL_INTERVAL, self.process_events)
+
+    def reset_progress(self):
+        self.units = OrderedDict()
+        self.files_queued = 0
+        self.files_done = 0
+        self.bytes_received = 0
+        self.started_at = None
+        self.recent_bytes = []  # (timestamp, nbytes) for the throughput window
+        self.units_changed = False
 
     def make_gui(self):
         logger.info('Building GUI')
@@ -75,15 +117,24 @@ class Gui:
         scrollbar.grid(row=0, column=1, rowspan=5, sticky='nsew')
 
         # Make the "login" button
-        self.go_button = ttk.Button(self.main_frame, text='Login',
+        self.login_button = ttk.Button(self.main_frame, text='Login',
                 command=self.login)
-        self.go_button.grid(row=4, column=2, sticky='es')
+        self.login_button.grid(row=4, column=2, sticky='es')
 
         # Make the "start downloading" button
         self.go_button = ttk.Button(self.main_frame, text='Start Downloading',
                 command=self.start_downloading)
         self.go_button.grid(row=4, column=3, sticky='es')
 
+        # Make the overall progress bar and status line
+        self.progress = ttk.Progressbar(self.main_frame, mode='determinate')
+        self.progress.grid(row=5, column=0, columnspan=4, sticky='ew',
+                pady=(10, 0))
+
+        self.status = tk.StringVar(value='Idle')
+        ttk.Label(self.main_frame, textvariable=self.status).grid(row=6, 
+                column=0, columnspan=4, sticky='w')
+
     def login(self):
         logger.info('Login button pressed')
 
@@ -94,26 +145,68 @@ class Gui:
         # Check all required fields are filled in
         if username and password and savefile:
             logger.info('Attempting login')
-            self.browser = Browser(username, password, savefile)
-            self.bootstrap_browser(self.browser)
+            self.credentials = (username, password, savefile)
+            self.browser = self.new_browser()
 
             # Do the login in a different thread
-            Thread(target=self.browser.login).start()
+            Thread(target=self.try_login, args=(self.browser,)).start()
         else:
             showwarning('Ok', 'Please fill in all necessary fields.')
             logger.warn("Required fields haven't been filled in")
 
 
+    def new_browser(self):
+        """
+        Make a Browser for whoever last pressed the Login button.
+        """
+        browser = Browser(*self.credentials)
+        self.bootstrap_browser(browser)
+        return browser
+
+    def try_login(self, browser):
+        try:
+            browser.login()
+        except ScrapeError:
+            # The "on_login_failed" hook has already told the user
+            pass
+        except Exception:
+            logger.exception('Unable to log in')
+            self.events.put(Event('login_failed', time.time(), {}))
+
     def start_downloading(self):
         logger.info('Download button pressed')
 
         if self.browser and self.browser.is_logged_in:
-            self.browser.spider_concurrent()
-            self.browser.download_concurrent()
+            self.go_button.state(['disabled'])
+            self.login_button.state(['disabled'])
+            self.downloading = True
+
+            # A Browser only does one crawl, otherwise its units and totals
+            # would pile up from one download to the next
+            self.browser = self.new_browser()
+            self.reset_progress()
+            self.started_at = time.time()
+
+            # Do the crawl in a different thread so Tk never blocks
+            Thread(target=self.scrape, args=(self.browser,), 
+                   daemon=True).start()
         else:
             logger.info('Not logged in')
             showerror('Ok', 'Not logged in')
 
+    def scrape(self, browser):
+        """
+        Run the crawl (on a worker thread), making sure the GUI hears about
+        it whether it finishes, fails or is stopped.
+        """
+        try:
+            browser.start_scraping()
+        except Exception as e:
+            logger.exception('Crawl failed')
+            self.events.put(Event('error', time.time(), {'error': e}))
+        finally:
+            self.events.put(Event('stopped', time.time(), {}))
+
     def ask_find_directory(self):
         save_location = askdirectory()
         self.savefile.set(save_location)
@@ -124,40 +217,142 @@ class Gui:
     def quit(self):
         self.root.destroy()
 
+    def process_events(self):
+        """
+        Drain (a batch of) the pending browser events, then refresh the
+        display once for the whole batch.
+        """
+        for _ in range(self.MAX_EVENTS_PER_POLL):
+            try:
+                event = self.events.get_nowait()
+            except Empty:
+                break
+
+            handler = getattr(self, 'on_' + event.name, None)
+            if handler is not None:
+                handler(event)
+
+        self.update_units()
+        self.update_status()
+        self.root.after(self.POLL_INTERVAL, self.process_events)
+
+    def unit_progress(self, unit):
+        if unit.name not in self.units:
+            self.units[unit.name] = UnitProgress(unit.name)
+            self.units_changed = True
+        return self.units[unit.name]
+
+    def on_units_found(self, event):
+        for unit in event.data['units']:
+            self.unit_progress(unit)
+
+    def on_file_queued(self, event):
+        self.files_queued += 1
+        self.unit_progress(event.data['document'].section.unit).queued += 1
+        self.units_changed = True
+
+    def on_bytes_received(self, event):
+        nbytes = event.data['nbytes']
+        self.bytes_received += nbytes
+        self.recent_bytes.append((event.timestamp, nbytes))
+
+        unit = event.data['document'].section.unit
+        self.unit_progress(unit).bytes_received += nbytes
+        self.units_changed = True
+
+    def on_file_done(self, event):
+        self.files_done += 1
+        self.unit_progress(event.data['document'].section.unit).done += 1
+        self.units_changed = True
+
+    def on_finished(self, event):
+        showinfo('Ok', 'Finished downloading')
+
+    def on_error(self, event):
+        showerror('Ok', 'Downloading failed: {}'.format(event.data['error']))
+
+    def on_stopped(self, event):
+        self.downloading = False
+        self.go_button.state(['!disabled'])
+        self.login_button.state(['!disabled'])
+
+    def on_login_successful(self, event):
+        # The browser logs in again while crawling, only tell the user about
+        # the login they asked for
+        if not self.downloading:
+            showinfo('Ok', 'Login Successful')
+
+    def on_login_failed(self, event):
+        if not self.downloading:
+            showerror('Ok', 'Login Unsuccessful')
+
+    def on_quit(self, event):
+        self.quit()
+
     def update_units(self):
+        if not self.units_changed:
+            return
+
         self.unit_box.delete(0, tk.END)
-        for unit in self.browser.units:
-            self.unit_box.insert(tk.END, unit.title)
+        for progress in self.units.values():
+            self.unit_box.insert(tk.END, str(progress))
 
-        self.root.after(1000, self.update_units)
+        self.units_changed = False
 
-    def bootstrap_browser(self, browser):
+    def throughput(self, window=5):
         """
-        Add in any hooks to the browser so they will be run on certain events.
+        The download rate (bytes/second) over the last few seconds.
         """
-        def on_quit(browser_instance, gui):
-            """Close the GUI"""
-            gui.quit()
+        now = time.time()
+        self.recent_bytes = [(t, n) for t, n in self.recent_bytes
+                             if now - t <= window]
 
-        def on_login_successful(browser_instance, gui):
-            """Fire off an info dialog and get units (in another thread)"""
-            # Thread(target=browser_instance.get_units).start()
-            gui.root.after(0, showinfo, 'Ok', 'Login Successful')
+        if not self.recent_bytes or self.started_at is None:
+            return 0
 
-        def on_login_failed(browser_instance, gui):
-            """Fire off an error dialog"""
-            showerror('Ok', 'Login Unsuccessful')
+        elapsed = min(window, now - self.started_at)
+        return sum(n for _, n in self.recent_bytes) / max(elapsed, 1e-3)
+
+    def eta(self):
+        """
+        Estimate the seconds remaining from the average time taken per file
+        so far. Returns None until there is enough to go on.
+        """
+        if not self.files_done or self.started_at is None:
+            return None
 
+        per_file = (time.time() - self.started_at) / self.files_done
+        return per_file * (self.files_queued - self.files_done)
 
-        def on_get_units(browser_instance, gui):
-            gui.root.after(0, gui.update_units)
+    def update_status(self):
+        if self.started_at is None:
+            return
 
-        hooks = [on_quit, on_login_successful, on_login_failed,
-                on_get_units]
+        self.progress['maximum'] = max(self.files_queued, 1)
+        self.progress['value'] = self.files_done
+
+        eta = self.eta()
+        self.status.set('{}/{} files, {} at {}/s, ETA {}'.format(
+            self.files_done, 
+            self.files_queued,
+            humansize(self.bytes_received),
+            humansize(self.throughput()),
+            '?' if eta is None else '{:.0f}s'.format(eta)))
+
+    def bootstrap_browser(self, browser):
+        """
+        Add in any hooks to the browser so they will be run on certain events.
+
+        Hooks and events fire on the browser's threads, so all they do is put
+        an Event on the queue for process_events() to handle on the Tk
+        thread.
+        """
+        browser.add_listener(self.events.put)
+
+        hooks = ['on_quit', 'on_login_successful', 'on_login_failed']
 
         # Do the actual bootstrapping
         for hook in hooks:
-            callback = lambda browser_instance: hook(browser_instance, self)
-            setattr(browser, hook.__name__, callback)
-
-        browser.on_login_failed(self)
+            event = Event(hook[len('on_'):], None, {})
+            callback = lambda browser_instance, event=event: self.events.put(event)
+            setattr(browser, hook, callback)
@@ -0,0 +1,188 @@
+import cProfile
+import heapq
+import os
+import pstats
+import sys
+from collections import Counter, defaultdict
+from threading import Lock, Thread, Event
+
+
+class PhaseStats:
+    def __init__(self):
+        self.count = 0
+        self.wall = 0
+        self.cpu = 0
+
+
+class SpanTimer:
+    """
+    Collects how long each phase of a crawl took (both wall time and CPU time
+    for the thread doing the work), plus the slowest individual URLs.
+
+    Spans can be nested (e.g. "parse" inside "scrape_section"), in which case
+    the outer span's time includes the inner one's.
+    """
+    def __init__(self, slowest=10):
+        self.slowest = slowest
+        self.phases = defaultdict(PhaseStats)
+        self._slowest_urls = []
+        self._counter = 0
+        self._lock = Lock()
+
+    def record(self, phase, label, wall, cpu):
+        with self._lock:
+            stats = self.phases[phase]
+            stats.count += 1
+            stats.wall += wall
+            stats.cpu += cpu
+
+            if label is not None:
+                self._add_slowest(wall, phase, label)
+
+    def _add_slowest(self, wall, phase, label):
+        # Keep a min-heap of the N slowest spans (called with the lock held)
+        self._counter += 1
+        entry = (wall, self._counter, phase, label)
+        if len(self._slowest_urls) < self.slowest:
+            heapq.heappush(self._slowest_urls, entry)
+        else:
+            heapq.heappushpop(self._slowest_urls, entry)
+
+    def merge(self, other):
+        """
+        Add the totals and slowest URLs from another SpanTimer to this one.
+        """
+        with other._lock:
+            phases = [(name, stats.count, stats.wall, stats.cpu)
+                      for name, stats in other.phases.items()]
+            slowest = list(other._slowest_urls)
+
+        with self._lock:
+            for name, count, wall, cpu in phases:
+                stats = self.phases[name]
+                stats.count += count
+                stats.wall += wall
+                stats.cpu += cpu
+
+            for wall, _, phase, label in slowest:
+                self._add_slowest(wall, phase, label)
+
+    def slowest_urls(self):
+        with self._lock:
+            return [(wall, phase, label) for wall, _, phase, label
+                    in sorted(self._slowest_urls, reverse=True)]
+
+    def report(self, stream=sys.stdout):
+        """
+        Write a table of where the time went and the slowest URLs.
+        """
+        if not self.phases:
+            return
+
+        header = '{:<16} {:>8} {:>10} {:>10} {:>10} {:>6}'.format(
+                'Phase', 'Count', 'Wall [s]', 'CPU [s]', 'Wait [s]', 'CPU %')
+        stream.write(header + '\n')
+        stream.write('-'*len(header) + '\n')
+
+        with self._lock:
+            phases = sorted(self.phases.items(), key=lambda p: -p[1].wall)
+
+        for name, stats in phases:
+            cpu_percent = 100 * stats.cpu / stats.wall if stats.wall else 0
+            stream.write('{:<16} {:>8} {:>10.2f} {:>10.2f} {:>10.2f} {:>6.1f}\n'
+                         .format(name, stats.count, stats.wall, stats.cpu,
+                                 max(stats.wall - stats.cpu, 0), cpu_percent))
+
+        slowest = self.slowest_urls()
+        if slowest:
+            stream.write('\nSlowest URLs:\n')
+            for wall, phase, label in slowest:
+                stream.write('{:>8.2f}s  {:<16} {}\n'.format(wall, phase, label))
+
+
+class SamplingProfiler:
+    """
+    Periodically grab the stack of every thread and count how often each
+    one was seen. The result is saved in the "folded" format understood by
+    flamegraph.pl, speedscope, etc. (one "frame;frame;frame count" per line).
+    """
+    OUTPUT = 'spider_board.folded'
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = Thread(target=self._run, name='SamplingProfiler',
+                              daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        me = self._thread.ident
+
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                self.stacks[self._fold(frame)] += 1
+
+    def _fold(self, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('{} ({}:{})'.format(code.co_name,
+                os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+
+        return ';'.join(reversed(names))
+
+    def save(self, filename=None, stream=sys.stdout):
+        filename = filename or self.OUTPUT
+        with open(filename, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+        stream.write('{} samples saved to {}\n'.format(
+            sum(self.stacks.values()), filename))
+        return filename
+
+
+class CProfiler:
+    """
+    Run cProfile for the duration of the crawl. This only sees the thread
+    which started it, so it is most useful with --sequential.
+    """
+    OUTPUT = 'spider_board.prof'
+
+    def __init__(self, top=25):
+        self.top = top
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def save(self, filename=None, stream=sys.stdout):
+        filename = filename or self.OUTPUT
+        self.profile.dump_stats(filename)
+
+        stats = pstats.Stats(self.profile, stream=stream)
+        stats.sort_stats('cumulative').print_stats(self.top)
+
+        stream.write('Profile saved to {}\n'.format(filename))
+        return filename
+
+
+PROFILERS = {
+        'sample': SamplingProfiler,
+        'cprofile': CProfiler,
+        }
@@ -0,0 +1,169 @@
+import pickle
+import sqlite3
+import time
+from queue import Queue
+from threading import RLock
+
+
+PENDING, TAKEN, DONE = range(3)
+
+
+class WorkQueue(Queue):
+    """
+    A normal in-memory Queue which also understands being told that an item
+    has been completely dealt with (so it doesn't need to be redone after a
+    crash). For an in-memory queue that is a no-op.
+    """
+    def mark_done(self, item):
+        pass
+
+    def checkpoint(self):
+        pass
+
+
+class CrawlState:
+    """
+    A SQLite database holding the crawl's work queues and a little bit of
+    metadata, so a run that gets killed can pick up where it stopped.
+
+    Writes are batched into transactions which are committed every
+    CHECKPOINT_EVERY operations (or CHECKPOINT_INTERVAL seconds), whenever
+    checkpoint() is called and when the state is closed.
+    """
+    CHECKPOINT_EVERY = 200
+    CHECKPOINT_INTERVAL = 5
+
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self.lock = RLock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+
+        self._pending_writes = 0
+        self._last_checkpoint = time.time()
+
+        with self.lock:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY,
+                queue TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                payload BLOB NOT NULL)''')
+            self.db.execute('''CREATE INDEX IF NOT EXISTS items_by_status
+                ON items (queue, status, id)''')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT)''')
+
+            if resume:
+                # Anything that was in flight when we died needs doing again
+                self.db.execute('UPDATE items SET status = ? WHERE status = ?',
+                                (PENDING, TAKEN))
+            else:
+                self.db.execute('DELETE FROM items')
+                self.db.execute('DELETE FROM meta')
+
+            self.db.commit()
+
+    def queue(self, name):
+        return PersistentQueue(self, name)
+
+    def execute(self, sql, params=()):
+        """
+        Run a statement which modifies the database, committing if it's time
+        for a checkpoint.
+        """
+        with self.lock:
+            cursor = self.db.execute(sql, params)
+            self._pending_writes += 1
+
+            if (self._pending_writes >= self.CHECKPOINT_EVERY or
+                    time.time() - self._last_checkpoint > self.CHECKPOINT_INTERVAL):
+                self.checkpoint()
+
+            return cursor
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def checkpoint(self):
+        with self.lock:
+            self.db.commit()
+            self._pending_writes = 0
+            self._last_checkpoint = time.time()
+
+    def get(self, key, default=None):
+        rows = self.query('SELECT value FROM meta WHERE key = ?', (key,))
+        return rows[0][0] if rows else default
+
+    def set(self, key, value):
+        self.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                     (key, value))
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+class PersistentQueue(WorkQueue):
+    """
+    A Queue which keeps its items in a CrawlState database instead of in
+    memory. Items are pickled, so they need to be picklable.
+
+    An item stays in the database (as "taken") after get() until mark_done()
+    is called, so if the process dies anything that was being worked on is
+    handed out again when the crawl is resumed.
+    """
+    def __init__(self, state, name, maxsize=0):
+        self.state = state
+        self.name = name
+        super().__init__(maxsize)
+
+        # Items left over from a previous run still need a task_done()
+        self.unfinished_tasks = self._qsize()
+
+    # The hooks below are called by Queue with self.mutex held
+
+    def _init(self, maxsize):
+        pass
+
+    def _qsize(self):
+        rows = self.state.query(
+                'SELECT COUNT(*) FROM items WHERE queue = ? AND status = ?',
+                (self.name, PENDING))
+        return rows[0][0]
+
+    def _put(self, item):
+        cursor = self.state.execute(
+                'INSERT INTO items (queue, status, payload) VALUES (?, ?, ?)',
+                (self.name, PENDING, pickle.dumps(item)))
+        item._queue_id = cursor.lastrowid
+
+    def _get(self):
+        with self.state.lock:
+            rows = self.state.query(
+                    '''SELECT id, payload FROM items
+                    WHERE queue = ? AND status = ?
+                    ORDER BY id LIMIT 1''',
+                    (self.name, PENDING))
+            item_id, payload = rows[0]
+            self.state.execute('UPDATE items SET status = ? WHERE id = ?',
+                               (TAKEN, item_id))
+
+        item = pickle.loads(payload)
+        item._queue_id = item_id
+        return item
+
+    def mark_done(self, item):
+        item_id = getattr(item, '_queue_id', None)
+        if item_id is None:
+            return
+
+        with self.mutex:
+            self.state.execute('UPDATE items SET status = ? WHERE id = ?',
+                               (DONE, item_id))
+
+    def checkpoint(self):
+        self.state.checkpoint()
@@ -0,0 +1,244 @@
+import json
+import logging
+import os
+import random
+import shutil
+import time
+from threading import Lock
+
+import requests
+
+from .utils import LOG_FILE, get_logger
+
+
+# Create the logging handlers and attach them
+logger = get_logger(__name__, LOG_FILE)
+
+stream_handler = logging.StreamHandler()
+stream_handler.setLevel(logging.INFO)
+logger.addHandler(stream_handler)
+
+
+# Errors
+# ======
+
+class ScrapeError(Exception):
+    """
+    Something went wrong while fetching or parsing a page. The "kind" picks
+    which RetryPolicy is used.
+    """
+    kind = 'unexpected'
+
+
+class RequestTimeout(ScrapeError):
+    kind = 'timeout'
+
+
+class ServerError(ScrapeError):
+    kind = 'server_error'
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class SessionExpired(ScrapeError):
+    """
+    Blackboard sent us back to the login page, so we need to log in again.
+    """
+    kind = 'session_expired'
+
+
+class PermanentError(ScrapeError):
+    """
+    Trying again won't help (e.g. a 404, or a page we don't understand).
+    """
+    kind = 'permanent'
+
+
+def classify(exc):
+    """
+    Turn any exception into a ScrapeError so we know what to do with it.
+    """
+    if isinstance(exc, ScrapeError):
+        return exc
+    elif isinstance(exc, (requests.Timeout, requests.ConnectionError)):
+        return RequestTimeout(str(exc))
+    else:
+        return ScrapeError('{}: {}'.format(exc.__class__.__name__, exc))
+
+
+def check_response(r, login_url):
+    """
+    Raise the right kind of ScrapeError for a bad response.
+    """
+    if r.url.startswith(login_url):
+        raise SessionExpired('Redirected to the login page: {}'.format(r.url))
+    elif r.status_code >= 500:
+        raise ServerError('{} from {}'.format(r.status_code, r.url),
+                          r.status_code)
+    elif r.status_code in (401, 403):
+        raise SessionExpired('{} from {}'.format(r.status_code, r.url))
+    elif not r.ok:
+        raise PermanentError('{} from {}'.format(r.status_code, r.url))
+
+
+# Retrying
+# ========
+
+class RetryPolicy:
+    """
+    How many times to try something and how long to wait in between, using
+    exponential backoff with "full jitter" so a pile of workers that failed
+    at the same time don't all come back at the same time.
+    """
+    def __init__(self, attempts=3, base_delay=1, max_delay=60):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        """
+        How long to sleep before the given (1-based) retry.
+        """
+        ceiling = min(self.max_delay, self.base_delay * 2**(attempt - 1))
+        return random.uniform(0, ceiling)
+
+    def __repr__(self):
+        return '<RetryPolicy: attempts={} base_delay={} max_delay={}>'.format(
+            self.attempts, self.base_delay, self.max_delay)
+
+
+DEFAULT_POLICIES = {
+        'timeout': RetryPolicy(attempts=5, base_delay=2),
+        'server_error': RetryPolicy(attempts=4, base_delay=5),
+        'session_expired': RetryPolicy(attempts=3, base_delay=1),
+        'permanent': RetryPolicy(attempts=1),
+        'unexpected': RetryPolicy(attempts=2, base_delay=1),
+        }
+
+
+class Retrier:
+    """
+    Call a function, retrying it according to the policy for whatever kind
+    of error it raised. Anything which still fails after its last attempt
+    is written to the dead letters instead of being raised.
+
+    relogin is called before retrying a SessionExpired error.
+    """
+    def __init__(self, relogin=None, dead_letters=None, policies=None,
+            sleep=time.sleep):
+        self.relogin = relogin
+        self.dead_letters = dead_letters
+        self.policies = dict(DEFAULT_POLICIES)
+        self.policies.update(policies or {})
+        self.sleep = sleep
+
+    def call(self, func, item, record=None):
+        """
+        Returns whatever func(item) returns, or None if it failed for good.
+        record is what gets saved to the dead letters if it does.
+        """
+        attempt = 0
+
+        while True:
+            attempt += 1
+            try:
+                return func(item)
+            except Exception as e:
+                error = classify(e)
+                policy = self.policies[error.kind]
+
+                if attempt >= policy.attempts:
+                    logger.error('Giving up on {} after {} attempt(s): {}'
+                                 .format(item, attempt, error))
+                    if error.kind == 'unexpected':
+                        logger.debug('Traceback for {}'.format(item),
+                                     exc_info=True)
+
+                    if self.dead_letters is not None and record is not None:
+                        self.dead_letters.add(record, error, attempt)
+                    return None
+
+                delay = policy.delay(attempt)
+                logger.warning('{} failed ({}: {}), retrying in {:.1f}s'
+                               .format(item, error.kind, error, delay))
+
+                if isinstance(error, SessionExpired) and self.relogin:
+                    self.relogin()
+
+                self.sleep(delay)
+
+
+# Dead letters
+# ============
+
+class DeadLetters:
+    """
+    A file of everything which permanently failed, one JSON record per line,
+    so a later run can retry just those.
+
+    Records are written to "filename.part" while the crawl runs and only
+    replace the real file when commit() is called at the end, so each run
+    starts afresh and a crash never loses the previous run's failures. With
+    keep_existing=True (e.g. when resuming) the old records are carried over.
+    """
+    def __init__(self, filename, keep_existing=False):
+        self.filename = filename
+        self.part_filename = filename + '.part'
+        self.count = 0
+        self._lock = Lock()
+
+        if keep_existing and os.path.exists(self.filename):
+            shutil.copyfile(self.filename, self.part_filename)
+            self.count = len(read_dead_letters(self.filename))
+        elif os.path.exists(self.part_filename):
+            # Left behind by a run which was killed
+            os.remove(self.part_filename)
+
+    def add(self, record, error, attempts):
+        record = dict(record)
+        record.update(
+                error=error.kind,
+                message=str(error),
+                attempts=attempts,
+                timestamp=time.time())
+
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.filename)),
+                        exist_ok=True)
+            with open(self.part_filename, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+            self.count += 1
+
+    def commit(self):
+        """
+        Replace the dead letter file with this run's records (removing it if
+        nothing failed).
+        """
+        with self._lock:
+            if os.path.exists(self.part_filename):
+                os.replace(self.part_filename, self.filename)
+            elif os.path.exists(self.filename):
+                os.remove(self.filename)
+
+    def discard(self):
+        """
+        Throw away this run's records and leave the old file alone.
+        """
+        with self._lock:
+            if os.path.exists(self.part_filename):
+                os.remove(self.part_filename)
+            self.count = 0
+
+
+def read_dead_letters(filename):
+    records = []
+
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+
+    return records
@@ -0,0 +1,384 @@
+import os
+import posixpath
+import shutil
+import tarfile
+import tempfile
+import uuid
+import zipfile
+import zlib
+from threading import Lock
+
+
+# Files bigger than this get spooled to disk instead of being held in memory
+# while they wait to be written to an archive or uploaded
+SPOOL_SIZE = 8*1024*1024
+
+
+def _read_umask():
+    # The only way to read the umask is to change it, which affects every
+    # thread in the process, so this is only done once (at import time)
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# Temporary files are only readable by us, but finished files should get the
+# same permissions open() would have given them
+FILE_MODE = 0o666 & ~_read_umask()
+
+ARCHIVE_MODES = [
+        ('.tar.gz', 'w|gz'),
+        ('.tgz', 'w|gz'),
+        ('.tar.bz2', 'w|bz2'),
+        ('.tar.xz', 'w|xz'),
+        ('.tar', 'w|'),
+        ('.zip', None),
+        ]
+
+
+class Storage:
+    """
+    Somewhere to save downloaded files. Paths are always relative and use
+    the OS's path separator, the same as Attachment.filename.
+
+    Storage objects are shared between all of a Browser's worker threads, so
+    every method needs to be thread-safe.
+    """
+    # A local directory the crawl can keep its own state in (if any)
+    local_dir = None
+
+    def exists(self, path):
+        raise NotImplementedError
+
+    def save(self, path, chunks):
+        """
+        Save the byte strings yielded by chunks to path. Nothing should be
+        visible at path unless the whole file was saved.
+        """
+        raise NotImplementedError
+
+    def copy(self, source, destination):
+        """
+        Copy a file which has already been saved to another path.
+        """
+        raise NotImplementedError
+
+    def resolve(self, path):
+        """
+        Find the underlying storage a path is really saved in and the path
+        within it, so files can be copied between sub-directories.
+        """
+        return self, path
+
+    def subdir(self, name):
+        """
+        Get a view of this storage where every path is inside "name".
+        """
+        return PrefixedStorage(self, name)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PrefixedStorage(Storage):
+    def __init__(self, parent, prefix):
+        self.parent = parent
+        self.prefix = prefix
+
+        if parent.local_dir is not None:
+            self.local_dir = os.path.join(parent.local_dir, prefix)
+
+    def exists(self, path):
+        return self.parent.exists(os.path.join(self.prefix, path))
+
+    def save(self, path, chunks):
+        self.parent.save(os.path.join(self.prefix, path), chunks)
+
+    def copy(self, source, destination):
+        self.parent.copy(os.path.join(self.prefix, source),
+                         os.path.join(self.prefix, destination))
+
+    def resolve(self, path):
+        return self.parent.resolve(os.path.join(self.prefix, path))
+
+    def __repr__(self):
+        return '<PrefixedStorage: {!r} {}>'.format(self.parent, self.prefix)
+
+
+class LocalStorage(Storage):
+    """
+    Save files to a directory on the local filesystem.
+
+    Files are written to a temporary file next to their destination and then
+    renamed into place, so a half-downloaded file never looks finished. The
+    directories which have already been created are remembered so we don't
+    hit the filesystem for every single file.
+    """
+    def __init__(self, root):
+        self.root = self.local_dir = os.path.abspath(root)
+        self._created_dirs = set()
+        self._lock = Lock()
+
+    def exists(self, path):
+        return os.path.exists(os.path.join(self.root, path))
+
+    def _make_dirs(self, directory):
+        with self._lock:
+            if directory in self._created_dirs:
+                return
+
+        os.makedirs(directory, exist_ok=True)
+
+        with self._lock:
+            self._created_dirs.add(directory)
+
+    def save(self, path, chunks):
+        destination = os.path.join(self.root, path)
+        parent_dir = os.path.dirname(destination)
+        self._make_dirs(parent_dir)
+
+        f = tempfile.NamedTemporaryFile(dir=parent_dir, prefix='.',
+                suffix='.part', delete=False)
+        try:
+            with f:
+                for chunk in chunks:
+                    f.write(chunk)
+
+            os.chmod(f.name, FILE_MODE)
+            os.replace(f.name, destination)
+        except BaseException:
+            os.remove(f.name)
+            raise
+
+    def copy(self, source, destination):
+        source = os.path.join(self.root, source)
+        destination = os.path.join(self.root, destination)
+        parent_dir = os.path.dirname(destination)
+        self._make_dirs(parent_dir)
+
+        # Hard link when we can, it's instant and takes no extra space
+        temp = os.path.join(parent_dir, '.{}.part'.format(uuid.uuid4().hex))
+        try:
+            os.link(source, temp)
+        except OSError:
+            shutil.copyfile(source, temp)
+
+        os.replace(temp, destination)
+
+    def __repr__(self):
+        return '<LocalStorage: {}>'.format(self.root)
+
+
+class ArchiveStorage(Storage):
+    """
+    Stream files straight into a single zip or tar archive (optionally
+    compressed, depending on the file extension).
+
+    Each file is downloaded into a spooled temporary file first so workers
+    only hold the archive's lock while copying a finished file into it.
+
+    With append=True an existing archive is added to instead of replaced
+    (zips are opened in append mode, tars are copied into a new archive
+    because compressed tars can't be appended to). A ValueError is raised if
+    the existing archive is damaged, e.g. because the process was killed
+    before it could be closed.
+    """
+    def __init__(self, filename, append=False):
+        self.filename = os.path.abspath(filename)
+        self.local_dir = os.path.dirname(self.filename)
+        self._names = set()
+        self._lock = Lock()
+
+        os.makedirs(self.local_dir, exist_ok=True)
+
+        existing = append and os.path.exists(self.filename)
+
+        mode = archive_mode(self.filename)
+        if mode is None:
+            # Append mode would quietly tack a new zip onto the end of a
+            # damaged one, losing everything already in it
+            if existing and not zipfile.is_zipfile(self.filename):
+                raise ValueError('Unable to add to damaged archive: {}'.format(
+                    self.filename))
+
+            self.archive = zipfile.ZipFile(self.filename, 
+                    'a' if existing else 'w',
+                    compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+            self._names.update(self.archive.namelist())
+        elif existing:
+            old_filename = self.filename + '.old'
+            os.replace(self.filename, old_filename)
+
+            self.archive = tarfile.open(self.filename, mode)
+            try:
+                self._copy_tar(old_filename)
+            except (tarfile.TarError, EOFError, OSError, zlib.error):
+                self.archive.close()
+                os.replace(old_filename, self.filename)
+                raise ValueError('Unable to add to damaged archive: {}'.format(
+                    self.filename))
+
+            os.remove(old_filename)
+        else:
+            self.archive = tarfile.open(self.filename, mode)
+
+    def _copy_tar(self, filename):
+        with tarfile.open(filename, 'r:*') as old:
+            for member in old:
+                fileobj = old.extractfile(member) if member.isfile() else None
+                self.archive.addfile(member, fileobj)
+                self._names.add(member.name)
+
+    def _name(self, path):
+        return posixpath.join(*path.split(os.sep))
+
+    def exists(self, path):
+        with self._lock:
+            return self._name(path) in self._names
+
+    def save(self, path, chunks):
+        name = self._name(path)
+
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as spool:
+            for chunk in chunks:
+                spool.write(chunk)
+            size = spool.tell()
+            spool.seek(0)
+
+            with self._lock:
+                if isinstance(self.archive, zipfile.ZipFile):
+                    with self.archive.open(name, 'w', force_zip64=True) as dest:
+                        shutil.copyfileobj(spool, dest)
+                else:
+                    info = tarfile.TarInfo(name)
+                    info.size = size
+                    self.archive.addfile(info, spool)
+
+                self._names.add(name)
+
+    def copy(self, source, destination):
+        source, destination = self._name(source), self._name(destination)
+
+        with self._lock:
+            if isinstance(self.archive, zipfile.ZipFile):
+                with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as spool:
+                    with self.archive.open(source) as src:
+                        shutil.copyfileobj(src, spool)
+                    spool.seek(0)
+
+                    with self.archive.open(destination, 'w', 
+                                           force_zip64=True) as dest:
+                        shutil.copyfileobj(spool, dest)
+            else:
+                # Tars can hold hard links, which take up no space
+                info = tarfile.TarInfo(destination)
+                info.type = tarfile.LNKTYPE
+                info.linkname = source
+                self.archive.addfile(info)
+
+            self._names.add(destination)
+
+    def close(self):
+        with self._lock:
+            self.archive.close()
+
+    def __repr__(self):
+        return '<ArchiveStorage: {}>'.format(self.filename)
+
+
+class S3Storage(Storage):
+    """
+    Upload files to an S3 compatible object store. This needs the optional
+    "boto3" dependency (pip install spider_board[s3]).
+
+    Credentials are found the same way as any other boto3 program. Use
+    endpoint_url to point it at something other than AWS, e.g. a local
+    MinIO server for testing, or pass in a ready-made client.
+    """
+    def __init__(self, bucket, prefix='', endpoint_url=None, client=None):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise ImportError('S3 storage needs boto3, install it with '
+                              '"pip install boto3"')
+
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.client = client or boto3.client('s3', endpoint_url=endpoint_url)
+        self._client_error = ClientError
+
+    def _key(self, path):
+        return posixpath.join(self.prefix, *path.split(os.sep))
+
+    def exists(self, path):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(path))
+        except self._client_error as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    def save(self, path, chunks):
+        # S3 objects only appear once the upload completes, so there's no
+        # need for a temporary name
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as spool:
+            for chunk in chunks:
+                spool.write(chunk)
+            spool.seek(0)
+
+            self.client.upload_fileobj(spool, self.bucket, self._key(path))
+
+    def copy(self, source, destination):
+        # Done server side, nothing gets downloaded again
+        self.client.copy_object(Bucket=self.bucket, Key=self._key(destination),
+                CopySource={'Bucket': self.bucket, 'Key': self._key(source)})
+
+    def __repr__(self):
+        return '<S3Storage: s3://{}/{}>'.format(self.bucket, self.prefix)
+
+
+def archive_mode(filename):
+    """
+    Get the tarfile mode for an archive's filename, None for a zip file.
+    Raises a ValueError if it isn't an archive we know how to write.
+    """
+    for extension, mode in ARCHIVE_MODES:
+        if filename.lower().endswith(extension):
+            return mode
+
+    raise ValueError('Unknown archive type: {}'.format(filename))
+
+
+def is_archive(filename):
+    try:
+        archive_mode(filename)
+    except ValueError:
+        return False
+    return True
+
+
+def open_storage(destination, s3_endpoint=None, append=False):
+    """
+    Pick a storage backend for a destination:
+
+    - "s3://bucket/some/prefix" uploads to an S3 bucket
+    - anything ending in .zip, .tar, .tar.gz, .tgz, .tar.bz2 or .tar.xz is
+      written to a single archive (added to rather than replaced if append
+      is set, e.g. when resuming)
+    - everything else is treated as a local directory
+    """
+    if destination.startswith('s3://'):
+        bucket, _, prefix = destination[len('s3://'):].partition('/')
+        return S3Storage(bucket, prefix, endpoint_url=s3_endpoint)
+    elif is_archive(destination):
+        return ArchiveStorage(destination, append=append)
+    else:
+        return LocalStorage(destination)
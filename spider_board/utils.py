@@ -18,7 +18,8 @@ FILESIZE_SUFFIX = ['B', 'KB', 'MB', 'GB', 'TB', 'PB']
 def get_logger(name, log_file, log_level=None):
     logger = logging.getLogger(name)
 
-    file_handler = logging.FileHandler(log_file)
+    # Don't create/open the log file until something is actually logged
+    file_handler = logging.FileHandler(log_file, delay=True)
     formatter = logging.Formatter(
             "%(asctime)s - %(name)s - %(levelname)s: %(message)s",
             datefmt='%Y/%m/%d %I:%M:%S %p')
@@ -0,0 +1,123 @@
+import random
+import time
+
+import pytest
+
+from spider_board.client import Browser
+
+
+BLACKBOARD_URL = 'https://lms.curtin.edu.au/'
+FOLDER_LINK = '/webapps/blackboard/content/listContent.jsp?folder='
+
+
+class FakeResponse:
+    def __init__(self, url, text='', content=b'', status_code=200):
+        self.url = url
+        self.text = text
+        self.content = content
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = {
+                'content-length': str(len(content)),
+                'Content-Type': 'application/pdf',
+                }
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+
+class FakeBlackboard:
+    """
+    Pretends to be a requests session talking to Blackboard. Each unit has
+    one section holding some files and a couple of folders, each of which
+    holds more files and a nested folder of its own.
+    """
+    def __init__(self, units=3, files_per_folder=3, folders=2, depth=2):
+        self.pages = {}
+        self.files = {}
+        self.requests = []
+        # The keyword arguments every request was made with
+        self.request_kwargs = []
+
+        unit_links = []
+        for u in range(units):
+            unit_url = (BLACKBOARD_URL + 'webapps/portal/frameset.jsp'
+                        '?type=Course&id=_{}_1&url='.format(u))
+            unit_links.append('<a href="{}">Unit {}</a>'.format(unit_url, u))
+
+            section_url = BLACKBOARD_URL + 'section/{}'.format(u)
+            self.pages[unit_url] = (
+                    '<div id="courseMenuPalette_contents">'
+                    '<a href="/section/{}"><span title="Content">Content</span>'
+                    '</a></div>'.format(u))
+            self._add_folder(section_url, str(u), files_per_folder, folders,
+                             depth)
+
+        self.pages[BLACKBOARD_URL + 'webapps/portal/execute/tabs/'
+                   'tabAction?tab_tab_group_id=_3_1'] = ''.join(unit_links)
+
+    def _add_folder(self, url, name, files_per_folder, folders, depth):
+        links = []
+        for f in range(files_per_folder):
+            file_url = BLACKBOARD_URL + 'file/{}-{}'.format(name, f)
+            self.files[file_url] = 'contents of {}-{}'.format(name, f).encode()
+            links.append('<li><a href="/file/{0}-{1}">file {0}-{1}.pdf</a></li>'
+                         .format(name, f))
+        attachments = '<ul class="attachments">{}</ul>'.format(''.join(links))
+
+        folder_links = []
+        if depth > 0:
+            for f in range(folders):
+                child = '{}_{}'.format(name, f)
+                folder_links.append('<a href="{}{}">Folder {}</a>'.format(
+                    FOLDER_LINK, child, child))
+                self._add_folder(BLACKBOARD_URL + FOLDER_LINK.lstrip('/') + child,
+                                 child, files_per_folder, 1, depth - 1)
+
+        self.pages[url] = '<div id="content">{}{}</div>'.format(
+                ''.join(folder_links), attachments)
+
+    def post(self, url, data=None, **kwargs):
+        self.request_kwargs.append(kwargs)
+        return FakeResponse(url, 'You are being redirected to another page')
+
+    def head(self, url, **kwargs):
+        self.request_kwargs.append(kwargs)
+        return FakeResponse(url, content=self.files.get(url, b''))
+
+    def get(self, url, **kwargs):
+        self.requests.append(url)
+        self.request_kwargs.append(kwargs)
+        # Shuffle the order the worker threads finish in
+        time.sleep(random.random() * 0.002)
+
+        if url in self.files:
+            return FakeResponse(url, content=self.files[url])
+        elif url in self.pages:
+            return FakeResponse(url, self.pages[url])
+        else:
+            return FakeResponse(url, 'Not Found', status_code=404)
+
+
+@pytest.fixture
+def blackboard():
+    return FakeBlackboard()
+
+
+@pytest.fixture
+def make_browser(blackboard, tmp_path):
+    def make_browser(username='alice', **kwargs):
+        kwargs.setdefault('download_dir', str(tmp_path / username))
+        browser = Browser(username, 'password', **kwargs)
+        browser.session = browser.b = blackboard
+        # Don't actually wait between retries
+        browser.retrier.sleep = lambda delay: None
+        return browser
+
+    return make_browser
+
+
+def downloaded_files(directory):
+    return sorted(str(p.relative_to(directory)) for p in directory.rglob('*')
+                  if p.is_file() and not p.name.startswith(('.', 'spider')))
@@ -0,0 +1,136 @@
+import io
+import tarfile
+import zipfile
+from concurrent.futures import wait
+from threading import Thread
+
+import pytest
+import requests
+
+from spider_board import batch
+from spider_board.batch import BatchRunner
+from spider_board.storage import open_storage
+
+from conftest import downloaded_files
+
+
+def test_report_is_written_to_the_stream(tmp_path):
+    runner = BatchRunner([], str(tmp_path))
+    runner.elapsed = 1
+
+    stream = io.StringIO()
+    runner.report(stream)
+
+    assert 'Account' in stream.getvalue()
+    assert 'Total' in stream.getvalue()
+
+
+def test_shared_files_are_downloaded_once_but_saved_for_everyone(
+        blackboard, tmp_path, monkeypatch):
+    monkeypatch.setattr(requests, 'session', lambda: blackboard)
+
+    runner = BatchRunner([('alice', 'pw'), ('bob', 'pw'), ('carol', 'pw')],
+                         str(tmp_path), threads=8)
+    runner.run(stream=io.StringIO())
+
+    for username in ['alice', 'bob', 'carol']:
+        files = downloaded_files(tmp_path / username)
+        assert len(files) == len(blackboard.files)
+
+    fetched = [url for url in blackboard.requests if url in blackboard.files]
+    assert sorted(fetched) == sorted(blackboard.files)
+
+
+@pytest.mark.parametrize('name', ['mirror.zip', 'mirror.tar.gz'])
+def test_shared_files_are_copied_inside_archives(blackboard, tmp_path, 
+                                                 monkeypatch, name):
+    monkeypatch.setattr(requests, 'session', lambda: blackboard)
+
+    filename = str(tmp_path / name)
+    with open_storage(filename) as storage:
+        runner = BatchRunner([('alice', 'pw'), ('bob', 'pw')], str(tmp_path), 
+                             storage=storage, threads=8)
+        runner.run(stream=io.StringIO())
+
+    if name.endswith('.zip'):
+        archive = zipfile.ZipFile(filename)
+        contents = {n: archive.read(n) for n in archive.namelist()}
+    else:
+        archive = tarfile.open(filename)
+        contents = {m.name: archive.extractfile(m).read() 
+                    for m in archive.getmembers()}
+
+    assert len(contents) == 2 * len(blackboard.files)
+    for name, data in contents.items():
+        other = ('bob' if name.startswith('alice/') else 'alice') + name[name.index('/'):]
+        assert contents[other] == data
+
+
+def test_report_counts_failures(blackboard, tmp_path, monkeypatch):
+    monkeypatch.setattr(requests, 'session', lambda: blackboard)
+    missing = sorted(blackboard.files)[0]
+    del blackboard.files[missing]
+
+    runner = BatchRunner([('alice', 'pw'), ('bob', 'pw')], str(tmp_path),
+                         threads=8)
+    stream = io.StringIO()
+    runner.run(stream=stream)
+
+    assert [b.dead_letters.count for b in runner.browsers] == [1, 1]
+    lines = stream.getvalue().splitlines()
+    assert 'Failed' in lines[0]
+    assert [line.split()[-1] for line in lines 
+            if line.startswith('Total')] == ['2']
+
+
+def test_interrupted_batch_stops_every_account(blackboard, tmp_path, 
+                                               monkeypatch):
+    monkeypatch.setattr(requests, 'session', lambda: blackboard)
+
+    def interrupt(*args, **kwargs):
+        # Only the first wait (in the main thread) is interrupted
+        monkeypatch.setattr(batch, 'wait', wait)
+        raise KeyboardInterrupt
+    monkeypatch.setattr(batch, 'wait', interrupt)
+
+    accounts = [('user{}'.format(i), 'pw') for i in range(6)]
+    runner = BatchRunner(accounts, str(tmp_path), threads=4, 
+                         parallel_accounts=2)
+    stream = io.StringIO()
+
+    thread = Thread(target=runner.run, args=(stream,), daemon=True)
+    thread.start()
+    thread.join(30)
+    assert not thread.is_alive(), 'The batch never stopped'
+
+    assert runner.cancelled
+    assert all(b.interrupted for b in runner.browsers 
+               if b.username not in runner.cancelled)
+    assert 'Total' in stream.getvalue()
+
+
+def test_progress_lines_are_written_while_running(blackboard, tmp_path,
+                                                  monkeypatch):
+    monkeypatch.setattr(requests, 'session', lambda: blackboard)
+    monkeypatch.setattr(BatchRunner, 'PROGRESS_INTERVAL', 0.01)
+
+    runner = BatchRunner([('alice', 'pw'), ('bob', 'pw')], str(tmp_path), 
+                         threads=8)
+    stream = io.StringIO()
+    runner.run(stream=stream)
+
+    assert 'accounts finished' in stream.getvalue()
+    assert runner.files_done == 2 * len(blackboard.files)
+
+
+def test_batch_prints_one_combined_timing_report(blackboard, tmp_path, 
+                                                 monkeypatch, capsys):
+    monkeypatch.setattr(requests, 'session', lambda: blackboard)
+
+    runner = BatchRunner([('alice', 'pw'), ('bob', 'pw')], str(tmp_path),
+                         threads=8)
+    stream = io.StringIO()
+    runner.run(stream=stream)
+
+    assert stream.getvalue().count('Phase') == 1
+    assert 'Phase' not in capsys.readouterr().out
@@ -0,0 +1,271 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
+
+import pytest
+
+from spider_board import client
+from spider_board.client import Browser, Section, Unit
+from spider_board.retry import PermanentError, ScrapeError, read_dead_letters
+from spider_board.storage import Storage
+
+from conftest import FakeResponse, downloaded_files
+
+
+def run_to_completion(browser, timeout=30):
+    thread = Thread(target=browser.start_scraping, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'The crawl never finished'
+
+
+def test_concurrent_crawl_finds_every_file(make_browser, blackboard, tmp_path):
+    for _ in range(5):
+        browser = make_browser(threads=8, force=True)
+        run_to_completion(browser)
+
+        assert len(downloaded_files(tmp_path / 'alice')) == len(blackboard.files)
+        assert browser.dead_letters.count == 0
+
+
+def test_sections_are_only_scraped_once(make_browser, blackboard):
+    browser = make_browser(threads=8)
+    run_to_completion(browser)
+
+    pages = [url for url in blackboard.requests if url in blackboard.pages]
+    assert len(pages) == len(set(pages))
+
+
+def test_sequential_crawl_finds_every_file(make_browser, blackboard, tmp_path):
+    browser = make_browser(seq=True)
+    run_to_completion(browser)
+
+    assert len(downloaded_files(tmp_path / 'alice')) == len(blackboard.files)
+
+
+class RemoteStorage(Storage):
+    """
+    A storage backend with no local directory, like S3Storage.
+    """
+    def __init__(self):
+        self.files = {}
+
+    def exists(self, path):
+        return path in self.files
+
+    def save(self, path, chunks):
+        self.files[path] = b''.join(chunks)
+
+
+def test_accounts_using_remote_storage_keep_separate_state(make_browser, 
+                                                          tmp_path):
+    storage = RemoteStorage()
+    alice = make_browser('alice', storage=storage.subdir('alice'), persist=True)
+    unit = Unit('Unit 0', 'https://example.com/unit', '0')
+    alice.sections.put(Section(unit, 'Content', 'https://example.com/section'))
+    alice.state.checkpoint()
+
+    bob = make_browser('bob', storage=storage.subdir('bob'), persist=True)
+
+    assert alice.state.filename != bob.state.filename
+    assert alice.dead_letters.filename != bob.dead_letters.filename
+    assert alice.sections.qsize() == 1
+
+
+def test_interrupted_crawl_can_be_resumed(make_browser, blackboard, tmp_path,
+                                          monkeypatch):
+    browser = make_browser(seq=True, persist=True)
+
+    # Pretend the user hit Ctrl-C part way through spidering
+    get = blackboard.get
+    def interrupt_after_a_while(url, **kwargs):
+        if len(blackboard.requests) >= 6:
+            raise KeyboardInterrupt
+        return get(url, **kwargs)
+    monkeypatch.setattr(blackboard, 'get', interrupt_after_a_while)
+
+    with pytest.raises(KeyboardInterrupt):
+        browser.start_scraping()
+
+    monkeypatch.undo()
+    finished = [url for url in blackboard.requests 
+                if url in blackboard.pages and 'tabAction' not in url]
+    assert finished
+    del blackboard.requests[:]
+
+    resumed = make_browser(seq=True, resume=True)
+    assert resumed.sections.qsize() > 0
+    run_to_completion(resumed)
+
+    assert len(downloaded_files(tmp_path / 'alice')) == len(blackboard.files)
+    assert not set(finished) & set(blackboard.requests)
+
+
+def test_each_run_starts_a_fresh_dead_letter_file(make_browser, blackboard):
+    missing = sorted(blackboard.files)[0]
+    contents = blackboard.files.pop(missing)
+
+    for _ in range(2):
+        browser = make_browser(seq=True, force=True)
+        run_to_completion(browser)
+
+        records = read_dead_letters(browser.dead_letters.filename)
+        assert [r['url'] for r in records] == [missing]
+        assert browser.dead_letters.count == 1
+
+    # Once it can be downloaded, retrying clears out the dead letters
+    blackboard.files[missing] = contents
+    retry = make_browser(seq=True)
+    retry.load_dead_letters(retry.dead_letters.filename)
+    run_to_completion(retry)
+
+    assert not os.path.exists(retry.dead_letters.filename)
+
+
+def test_interrupted_retry_keeps_the_old_dead_letters(make_browser, blackboard,
+                                                      monkeypatch):
+    for url in sorted(blackboard.files)[:3]:
+        del blackboard.files[url]
+
+    browser = make_browser(seq=True)
+    run_to_completion(browser)
+    filename = browser.dead_letters.filename
+    assert len(read_dead_letters(filename)) == 3
+
+    def interrupt(url, **kwargs):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(blackboard, 'get', interrupt)
+
+    retry = make_browser(seq=True)
+    retry.load_dead_letters(filename)
+    retry.start_scraping()
+
+    assert len(read_dead_letters(filename)) == 3
+
+
+def test_failing_unit_list_keeps_the_old_dead_letters(make_browser, blackboard,
+                                                      monkeypatch):
+    missing = sorted(blackboard.files)[0]
+    blackboard.files.pop(missing)
+
+    browser = make_browser(seq=True)
+    run_to_completion(browser)
+    filename = browser.dead_letters.filename
+
+    # Blackboard is having a bad day
+    get = blackboard.get
+    def unavailable(url, **kwargs):
+        if 'tabAction' in url:
+            return FakeResponse(url, 'Service Unavailable', status_code=503)
+        return get(url, **kwargs)
+    monkeypatch.setattr(blackboard, 'get', unavailable)
+
+    broken = make_browser(seq=True)
+    with pytest.raises(ScrapeError):
+        broken.start_scraping()
+
+    assert [r['url'] for r in read_dead_letters(filename)] == [missing]
+
+
+def test_failed_login_raises(make_browser, blackboard, monkeypatch):
+    monkeypatch.setattr(blackboard, 'post', 
+            lambda url, **kwargs: FakeResponse(url, 'Invalid password'))
+
+    browser = make_browser()
+    failed = []
+    browser.on_login_failed = lambda b: failed.append(b)
+
+    with pytest.raises(PermanentError):
+        browser.login()
+
+    assert failed == [browser]
+    assert not browser.is_logged_in
+
+
+def test_every_request_has_a_timeout(make_browser, blackboard):
+    browser = make_browser(threads=8)
+    run_to_completion(browser)
+
+    assert blackboard.request_kwargs
+    for kwargs in blackboard.request_kwargs:
+        assert kwargs['timeout'] == Browser.REQUEST_TIMEOUT
+
+
+class CountingPool(ThreadPoolExecutor):
+    """
+    A thread pool which remembers the most jobs it ever had waiting or
+    running at once.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pending = self.most_pending = 0
+        self.lock = Lock()
+
+    def submit(self, *args, **kwargs):
+        with self.lock:
+            self.pending += 1
+            self.most_pending = max(self.most_pending, self.pending)
+
+        fut = super().submit(*args, **kwargs)
+        fut.add_done_callback(self._done)
+        return fut
+
+    def _done(self, fut):
+        with self.lock:
+            self.pending -= 1
+
+
+def test_only_a_few_items_are_in_flight(make_browser, blackboard, tmp_path):
+    with CountingPool(max_workers=2) as pool:
+        browser = make_browser(threads=2, thread_pool=pool, persist=True)
+        run_to_completion(browser)
+
+    assert len(downloaded_files(tmp_path / 'alice')) == len(blackboard.files)
+    # Two slots per thread, plus the unit scrapes
+    assert pool.most_pending <= 2*2 + len(browser.units)
+
+
+def test_interrupting_a_concurrent_crawl_cancels_queued_work(
+        make_browser, blackboard, tmp_path, monkeypatch):
+    get = blackboard.get
+    def slow_downloads(url, **kwargs):
+        if url in blackboard.files:
+            time.sleep(0.02)
+        return get(url, **kwargs)
+    monkeypatch.setattr(blackboard, 'get', slow_downloads)
+
+    # Ctrl-C while waiting for the last downloads to finish
+    def interrupt(futures):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(client, 'wait', interrupt)
+
+    browser = make_browser(threads=2, persist=True)
+    run_to_completion(browser)
+    assert browser.interrupted
+    assert len(downloaded_files(tmp_path / 'alice')) < len(blackboard.files)
+
+    monkeypatch.undo()
+    resumed = make_browser(threads=2, resume=True)
+    run_to_completion(resumed)
+    assert len(downloaded_files(tmp_path / 'alice')) == len(blackboard.files)
+
+
+def test_getting_the_units_again_replaces_them(make_browser):
+    browser = make_browser()
+    browser.get_units()
+    browser.get_units()
+
+    assert len(browser.units) == 3
+
+
+def test_slowest_urls_are_only_listed_once(make_browser):
+    browser = make_browser(threads=8)
+    browser.spans.slowest = 1000
+    run_to_completion(browser)
+
+    labels = [label for _, _, label in browser.spans.slowest_urls()]
+    assert labels
+    assert len(labels) == len(set(labels))
+    # Nested phases are still timed
+    assert browser.spans.phases['request'].count > 0
@@ -0,0 +1,13 @@
+from spider_board.__main__ import main
+from spider_board.client import Browser
+
+
+def test_retry_failed_without_any_failures(tmp_path, monkeypatch, capsys):
+    started = []
+    monkeypatch.setattr(Browser, 'start_scraping', 
+                        lambda self: started.append(self))
+
+    main(['alice', 'pw', '-d', str(tmp_path), '--retry-failed'])
+
+    assert 'Nothing to retry' in capsys.readouterr().out
+    assert not started
@@ -0,0 +1,35 @@
+import io
+
+from spider_board.profiling import SpanTimer
+
+
+def test_report_shows_phases_and_slowest_urls():
+    spans = SpanTimer(slowest=2)
+    for i in range(5):
+        spans.record('download', 'https://example.com/{}'.format(i), i, i / 2)
+
+    stream = io.StringIO()
+    spans.report(stream)
+    report = stream.getvalue()
+
+    assert 'download' in report
+    assert 'https://example.com/4' in report
+    assert 'https://example.com/3' in report
+    assert 'https://example.com/2' not in report
+
+
+def test_merging_adds_up_phases_and_keeps_the_slowest_urls():
+    first, second = SpanTimer(slowest=2), SpanTimer(slowest=2)
+    first.record('download', 'https://example.com/1', 1, 0.5)
+    second.record('download', 'https://example.com/2', 2, 0.5)
+    second.record('request', None, 3, 0)
+
+    merged = SpanTimer(slowest=2)
+    merged.merge(first)
+    merged.merge(second)
+
+    assert merged.phases['download'].count == 2
+    assert merged.phases['download'].wall == 3
+    assert merged.phases['request'].count == 1
+    assert [label for _, _, label in merged.slowest_urls()] == [
+            'https://example.com/2', 'https://example.com/1']
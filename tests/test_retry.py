@@ -0,0 +1,125 @@
+import pytest
+import requests
+
+from spider_board.retry import (DeadLetters, PermanentError, RequestTimeout,
+                                Retrier, RetryPolicy, ScrapeError, ServerError,
+                                SessionExpired, check_response, classify,
+                                read_dead_letters)
+
+from conftest import FakeResponse
+
+
+LOGIN_URL = 'https://lms.curtin.edu.au/webapps/login/'
+
+
+def failing(*errors):
+    """
+    A function which raises each of errors in turn, then returns "ok".
+    """
+    errors = list(errors)
+    calls = []
+
+    def func(item):
+        calls.append(item)
+        if errors:
+            raise errors.pop(0)
+        return 'ok'
+
+    func.calls = calls
+    return func
+
+
+def test_classify():
+    assert isinstance(classify(requests.Timeout('slow')), RequestTimeout)
+    assert isinstance(classify(requests.ConnectionError('down')), 
+                      RequestTimeout)
+
+    error = ServerError('503')
+    assert classify(error) is error
+
+    assert classify(KeyError('x')).kind == 'unexpected'
+
+
+@pytest.mark.parametrize('url, status_code, error', [
+    ('https://lms.curtin.edu.au/page', 503, ServerError),
+    ('https://lms.curtin.edu.au/page', 403, SessionExpired),
+    ('https://lms.curtin.edu.au/page', 404, PermanentError),
+    (LOGIN_URL + '?new_loc=/page', 200, SessionExpired),
+    ])
+def test_check_response_raises(url, status_code, error):
+    with pytest.raises(error):
+        check_response(FakeResponse(url, status_code=status_code), LOGIN_URL)
+
+
+def test_check_response_accepts_good_responses():
+    check_response(FakeResponse('https://lms.curtin.edu.au/page'), LOGIN_URL)
+
+
+def test_server_errors_are_retried():
+    func = failing(ServerError('502'), ServerError('503'))
+    retrier = Retrier(sleep=lambda delay: None)
+
+    assert retrier.call(func, 'item') == 'ok'
+    assert len(func.calls) == 3
+
+
+def test_timeouts_are_retried():
+    func = failing(requests.Timeout('slow'), requests.ConnectionError('down'))
+    retrier = Retrier(sleep=lambda delay: None)
+
+    assert retrier.call(func, 'item') == 'ok'
+    assert len(func.calls) == 3
+
+
+def test_expired_session_logs_in_again():
+    logins = []
+    func = failing(SessionExpired('login page'))
+    retrier = Retrier(relogin=lambda: logins.append(1), 
+                      sleep=lambda delay: None)
+
+    assert retrier.call(func, 'item') == 'ok'
+    assert len(logins) == 1
+
+
+def test_giving_up_writes_a_dead_letter(tmp_path):
+    dead_letters = DeadLetters(str(tmp_path / 'failed.jsonl'))
+    retrier = Retrier(dead_letters=dead_letters, sleep=lambda delay: None,
+                      policies={'server_error': RetryPolicy(attempts=2)})
+    func = failing(*[ServerError('500')] * 5)
+
+    assert retrier.call(func, 'item', {'kind': 'document'}) is None
+    assert len(func.calls) == 2
+
+    dead_letters.commit()
+    [record] = read_dead_letters(dead_letters.filename)
+    assert record['error'] == 'server_error'
+    assert record['attempts'] == 2
+
+
+def test_permanent_errors_are_not_retried():
+    func = failing(PermanentError('404'))
+    retrier = Retrier(sleep=lambda delay: None)
+
+    assert retrier.call(func, 'item') is None
+    assert len(func.calls) == 1
+
+
+def test_backoff_stays_within_bounds():
+    policy = RetryPolicy(attempts=10, base_delay=2, max_delay=30)
+
+    for attempt in range(1, 10):
+        ceiling = min(30, 2 * 2**(attempt - 1))
+        for _ in range(50):
+            assert 0 <= policy.delay(attempt) <= ceiling
+
+
+def test_sleeps_between_attempts():
+    delays = []
+    retrier = Retrier(sleep=delays.append, 
+                      policies={'unexpected': RetryPolicy(attempts=3, 
+                                                          base_delay=1)})
+    retrier.call(failing(ScrapeError('a'), ScrapeError('b')), 'item')
+
+    assert len(delays) == 2
+    assert 0 <= delays[0] <= 1
+    assert 0 <= delays[1] <= 2
@@ -0,0 +1,148 @@
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from spider_board import storage as storage_module
+from spider_board.storage import (ArchiveStorage, LocalStorage, S3Storage,
+                                  open_storage)
+
+
+def save(storage, path, data=b'hello'):
+    storage.save(os.path.join(*path.split('/')), iter([data]))
+
+
+@pytest.mark.parametrize('name', ['out.zip', 'out.tar', 'out.tar.gz'])
+def test_appending_to_an_archive_keeps_existing_files(tmp_path, name):
+    filename = str(tmp_path / name)
+
+    with open_storage(filename) as storage:
+        save(storage, 'unit/first.pdf')
+
+    with open_storage(filename, append=True) as storage:
+        assert storage.exists(os.path.join('unit', 'first.pdf'))
+        save(storage, 'unit/second.pdf')
+
+    if name.endswith('.zip'):
+        names = zipfile.ZipFile(filename).namelist()
+    else:
+        names = tarfile.open(filename).getnames()
+    assert sorted(names) == ['unit/first.pdf', 'unit/second.pdf']
+
+
+def test_archive_is_replaced_unless_appending(tmp_path):
+    filename = str(tmp_path / 'out.zip')
+
+    with open_storage(filename) as storage:
+        save(storage, 'first.pdf')
+
+    with open_storage(filename) as storage:
+        assert not storage.exists('first.pdf')
+
+
+def test_damaged_archive_is_rejected(tmp_path):
+    filename = tmp_path / 'out.zip'
+    filename.write_bytes(b'PK\x03\x04 not really a zip')
+
+    with pytest.raises(ValueError):
+        ArchiveStorage(str(filename), append=True)
+
+
+def test_damaged_tar_is_left_alone(tmp_path):
+    filename = tmp_path / 'out.tar.gz'
+    filename.write_bytes(b'\x1f\x8b definitely not gzip')
+
+    with pytest.raises(ValueError):
+        ArchiveStorage(str(filename), append=True)
+
+    assert filename.read_bytes() == b'\x1f\x8b definitely not gzip'
+
+
+def test_local_files_get_the_usual_permissions(tmp_path, monkeypatch):
+    # The umask is read when the module is imported
+    monkeypatch.setattr(storage_module, 'FILE_MODE', 0o644)
+
+    storage = LocalStorage(str(tmp_path))
+    save(storage, 'unit/first.pdf')
+
+    mode = os.stat(str(tmp_path / 'unit' / 'first.pdf')).st_mode & 0o777
+    assert mode == 0o644
+
+
+def test_file_mode_follows_the_umask():
+    umask = os.umask(0o022)
+    os.umask(umask)
+
+    assert storage_module.FILE_MODE == 0o666 & ~umask
+
+
+class FakeS3Client:
+    """
+    Just enough of a boto3 S3 client to stand in for a real bucket.
+    """
+    def __init__(self, missing_code='404'):
+        self.objects = {}
+        self.copies = []
+        self.missing_code = missing_code
+
+    def head_object(self, Bucket, Key):
+        from botocore.exceptions import ClientError
+
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': self.missing_code}}, 
+                              'HeadObject')
+        return {}
+
+    def upload_fileobj(self, fileobj, bucket, key):
+        self.objects[(bucket, key)] = fileobj.read()
+
+    def copy_object(self, Bucket, Key, CopySource):
+        source = (CopySource['Bucket'], CopySource['Key'])
+        self.copies.append((source, (Bucket, Key)))
+        self.objects[(Bucket, Key)] = self.objects[source]
+
+
+@pytest.fixture
+def s3():
+    pytest.importorskip('boto3')
+    client = FakeS3Client()
+    return client, S3Storage('bucket', '/mirror/', client=client)
+
+
+def test_s3_keys_are_prefixed(s3):
+    client, storage = s3
+    save(storage, 'unit/first.pdf', b'data')
+
+    assert client.objects == {('bucket', 'mirror/unit/first.pdf'): b'data'}
+    assert storage.exists(os.path.join('unit', 'first.pdf'))
+
+
+@pytest.mark.parametrize('code', ['404', 'NoSuchKey', 'NotFound'])
+def test_missing_s3_objects_dont_exist(code):
+    pytest.importorskip('boto3')
+    storage = S3Storage('bucket', client=FakeS3Client(missing_code=code))
+
+    assert not storage.exists('missing.pdf')
+
+
+def test_other_s3_errors_are_raised():
+    pytest.importorskip('boto3')
+    from botocore.exceptions import ClientError
+
+    storage = S3Storage('bucket', client=FakeS3Client(missing_code='403'))
+
+    with pytest.raises(ClientError):
+        storage.exists('forbidden.pdf')
+
+
+def test_s3_copies_are_done_server_side(s3):
+    client, storage = s3
+    save(storage, 'alice/first.pdf', b'data')
+
+    storage.copy(os.path.join('alice', 'first.pdf'), 
+                 os.path.join('bob', 'first.pdf'))
+
+    assert client.copies == [(('bucket', 'mirror/alice/first.pdf'),
+                              ('bucket', 'mirror/bob/first.pdf'))]
+    assert client.objects[('bucket', 'mirror/bob/first.pdf')] == b'data'